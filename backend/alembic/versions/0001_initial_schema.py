@@ -0,0 +1,72 @@
+"""Initial schema, as created by Base.metadata.create_all before migrations were introduced
+
+Databases created that way are already at this revision:
+    alembic -c backend/alembic.ini stamp 0001
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("discord_id", sa.String()),
+        sa.Column("username", sa.String()),
+        sa.Column("avatar_url", sa.String()),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_discord_id", "users", ["discord_id"], unique=True)
+    op.create_index("ix_users_username", "users", ["username"])
+
+    op.create_table(
+        "input_texts",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("text", sa.String()),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id")),
+    )
+    op.create_index("ix_input_texts_id", "input_texts", ["id"])
+    op.create_index("ix_input_texts_text", "input_texts", ["text"])
+
+    op.create_table(
+        "lore_jobs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("theme_info", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id")),
+    )
+    op.create_index("ix_lore_jobs_id", "lore_jobs", ["id"])
+
+    op.create_table(
+        "lore_job_items",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("job_id", sa.Integer(), sa.ForeignKey("lore_jobs.id")),
+        sa.Column("position", sa.Integer()),
+        sa.Column("warband_text", sa.String()),
+        sa.Column("status", sa.String()),
+        sa.Column("result", sa.JSON(), nullable=True),
+        sa.Column("error", sa.String(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_lore_job_items_id", "lore_job_items", ["id"])
+    op.create_index("ix_lore_job_items_job_id", "lore_job_items", ["job_id"])
+    op.create_index("ix_lore_job_items_status", "lore_job_items", ["status"])
+
+
+def downgrade():
+    op.drop_table("lore_job_items")
+    op.drop_table("lore_jobs")
+    op.drop_table("input_texts")
+    op.drop_table("users")
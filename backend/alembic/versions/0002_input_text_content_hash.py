@@ -0,0 +1,77 @@
+"""Replace the B-tree index on input_texts.text with an indexed content hash
+
+Existing rows get their hash backfilled; duplicate texts of the same owner are
+collapsed onto the oldest row so the unique index can be built.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+
+"""
+import hashlib
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def upgrade():
+    op.drop_index("ix_input_texts_text", table_name="input_texts")
+    op.add_column("input_texts", sa.Column("content_hash", sa.String(64), nullable=True))
+
+    input_texts = sa.table(
+        "input_texts",
+        sa.column("id", sa.Integer),
+        sa.column("text", sa.String),
+        sa.column("owner_id", sa.Integer),
+        sa.column("content_hash", sa.String),
+    )
+    connection = op.get_bind()
+    seen = set()
+    duplicates = []
+    last_id = 0
+    while True:
+        # Page on the primary key, so only one batch of texts is in memory at a time
+        rows = connection.execute(
+            sa.select(input_texts.c.id, input_texts.c.text, input_texts.c.owner_id)
+            .where(input_texts.c.id > last_id)
+            .order_by(input_texts.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        updates = []
+        for row_id, text, owner_id in rows:
+            content_hash = hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+            if (owner_id, content_hash) in seen:
+                duplicates.append(row_id)
+            else:
+                seen.add((owner_id, content_hash))
+                updates.append({"row_id": row_id, "content_hash": content_hash})
+        if updates:
+            connection.execute(
+                input_texts.update().where(input_texts.c.id == sa.bindparam("row_id")).values(content_hash=sa.bindparam("content_hash")),
+                updates,
+            )
+    for start in range(0, len(duplicates), BACKFILL_BATCH_SIZE):
+        connection.execute(input_texts.delete().where(input_texts.c.id.in_(duplicates[start:start + BACKFILL_BATCH_SIZE])))
+
+    with op.batch_alter_table("input_texts") as batch_op:
+        batch_op.alter_column("content_hash", existing_type=sa.String(64), nullable=False)
+        batch_op.create_index("ix_input_texts_owner_id_content_hash", ["owner_id", "content_hash"], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table("input_texts") as batch_op:
+        batch_op.drop_index("ix_input_texts_owner_id_content_hash")
+        batch_op.drop_column("content_hash")
+    op.create_index("ix_input_texts_text", "input_texts", ["text"])
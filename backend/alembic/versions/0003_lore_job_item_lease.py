@@ -0,0 +1,31 @@
+"""Add a claim lease to lore job items
+
+Workers claim an item by setting claimed_at and claimed_by together with the running
+status; only running items whose lease has expired are picked up again.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("lore_job_items") as batch_op:
+        batch_op.add_column(sa.Column("claimed_at", sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column("claimed_by", sa.String(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("lore_job_items") as batch_op:
+        batch_op.drop_column("claimed_by")
+        batch_op.drop_column("claimed_at")
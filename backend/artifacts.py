@@ -0,0 +1,69 @@
+"""
+Build artifacts shared read-only by workers, such as the lore index and the math tables.
+
+An artifact path is a symlink to one of its versions, `<path>.v-*` next to it. A build writes a
+new version and flips the link with an atomic rename, so a reader that resolves the link once
+sees either the old version or the new one, never a half-written or half-removed one.
+"""
+import fcntl
+import glob
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def build_lock(path: str):
+    """
+    Hold an exclusive lock on building the artifact at `path`, across processes.
+    """
+    path = path.rstrip("/")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _swap_in(version_dir: str, path: str):
+    # Keep the version being replaced, which a reader may still be loading, and drop older ones
+    parent, name = os.path.split(os.path.abspath(path))
+    previous = os.path.realpath(path) if os.path.islink(path) else None
+    if os.path.isdir(path) and previous is None:
+        # An artifact from before versioned builds is moved aside once, so the link can take its place
+        previous = tempfile.mkdtemp(dir=parent, prefix=f"{name}.v-")
+        os.replace(path, previous)
+
+    link = version_dir + ".link"
+    os.symlink(os.path.basename(version_dir), link)
+    os.replace(link, path)
+
+    for old_dir in glob.glob(os.path.join(parent, f"{name}.v-*")):
+        if os.path.realpath(old_dir) not in (os.path.realpath(version_dir), previous):
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+
+@contextmanager
+def versioned_build(path: str):
+    """
+    Yield a fresh version directory for the artifact at `path`, and make it current once the
+    block completes; a failed build leaves the current version in place.
+
+    Builds of the same artifact must not overlap, since each removes the versions it replaces:
+    hold `build_lock(path)` around the block.
+    """
+    path = path.rstrip("/")
+    parent, name = os.path.split(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    version_dir = tempfile.mkdtemp(dir=parent, prefix=f"{name}.v-")
+    try:
+        # mkdtemp creates it private; the artifact is read by every worker
+        os.chmod(version_dir, 0o755)
+        yield version_dir
+        _swap_in(version_dir, path)
+    except BaseException:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
@@ -1,27 +1,65 @@
-from fastapi import Request, HTTPException, status, Depends
+from fastapi import Request, HTTPException, status
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
-from .database import get_db
+from types import SimpleNamespace
+from .cache import LRUCache
+from .metrics import register_cache
+from sqlalchemy import select
+from .database import AsyncSessionLocal
 from .models import User
 import os
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 
-def get_current_user(request: Request, db: Session = Depends(get_db)):
+# Users by token subject, so warm authenticated requests don't touch the database.
+# Each process has its own cache: the OAuth callback invalidates the local entry, and
+# the TTL bounds how long other workers may serve a stale profile.
+USER_CACHE = LRUCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "300"))
+)
+register_cache("user", USER_CACHE)
+# Answer read-only profile routes like /me from the signed token claims alone
+TRUST_JWT_CLAIMS = os.getenv("TRUST_JWT_CLAIMS", "false").lower() == "true"
+
+def _token_claims(request: Request) -> dict:
     token = request.cookies.get("access_token")
     if not token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if user_id is None:
+        if payload.get("sub") is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    return payload
+
+def invalidate_user(user_id):
+    USER_CACHE.delete(str(user_id))
 
-    user = db.query(User).filter(User.id == user_id).first()
+async def _load_user(user_id: str) -> User:
+    user = USER_CACHE.get(user_id)
     if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+        async with AsyncSessionLocal() as db:
+            user = await db.scalar(select(User).where(User.id == int(user_id)))
+            if user is None:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+            # Detach it so the cached copy can be shared by requests without a session
+            db.expunge(user)
+        USER_CACHE.set(user_id, user)
     return user
 
+async def get_current_user(request: Request):
+    return await _load_user(_token_claims(request)["sub"])
+
+async def get_current_user_claims(request: Request):
+    """
+    The current user as described by the token, without a lookup when TRUST_JWT_CLAIMS is set.
+
+    Only for read-only routes: the claims reflect the profile when the token was issued.
+    Tokens issued before the profile claims were added fall back to the lookup.
+    """
+    claims = _token_claims(request)
+    if TRUST_JWT_CLAIMS and "username" in claims:
+        return SimpleNamespace(id=int(claims["sub"]), username=claims["username"], avatar_url=claims.get("avatar_url"))
+    return await _load_user(claims["sub"])
@@ -0,0 +1,67 @@
+"""
+Measure how long importing the API takes and how much memory it holds, per deployment mode.
+
+Each sample imports `backend.main` in a fresh interpreter, so nothing is shared between runs.
+Run from the repository root:
+
+    python -m backend.benchmarks.bench_startup --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MODES = ("math", "full")
+
+# Runs in the child interpreter; reports the import time, peak RSS and loaded heavy modules
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import backend.main
+seconds = time.perf_counter() - start
+heavy = ("scipy", "matplotlib", "langchain", "langgraph", "faiss", "sqlalchemy")
+print(json.dumps({
+    "import_seconds": seconds,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "loaded": sorted(name for name in heavy if name in sys.modules),
+}))
+"""
+
+
+def sample(mode: str) -> dict:
+    env = dict(os.environ, APP_MODE=mode)
+    # The full app creates its tables on import; don't touch a real database for a benchmark
+    env.setdefault("DATABASE_URL", "sqlite://")
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def bench(mode: str, repeat: int) -> dict:
+    samples = [sample(mode) for _ in range(repeat)]
+    return {
+        "mode": mode,
+        "import_seconds_median": statistics.median(s["import_seconds"] for s in samples),
+        "import_seconds_max": max(s["import_seconds"] for s in samples),
+        "max_rss_mb_median": statistics.median(s["max_rss_mb"] for s in samples),
+        "loaded": samples[-1]["loaded"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark API import time and memory per APP_MODE.")
+    parser.add_argument("--mode", choices=MODES, action="append", help="Modes to measure, all by default.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = [bench(mode, args.repeat) for mode in args.mode or MODES]
+    for result in results:
+        print(
+            f"{result['mode']:>5}: import {result['import_seconds_median'] * 1000:7.1f} ms "
+            f"(max {result['import_seconds_max'] * 1000:.1f} ms), "
+            f"RSS {result['max_rss_mb_median']:6.1f} MB, heavy modules: {', '.join(result['loaded']) or 'none'}"
+        )
+    print(json.dumps(results, indent=2))
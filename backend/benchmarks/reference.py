@@ -0,0 +1,130 @@
+"""
+Brute-force reference implementations of the dice math, for correctness checks.
+
+Everything here enumerates ordered outcomes with exact fractions and follows the game
+rules step by step, sharing no code with `backend.trench_crusade_math`. It is only
+feasible for a handful of dice and hits, which is all the checks need.
+"""
+from collections import Counter
+from fractions import Fraction
+from itertools import product
+
+FACES = range(1, 7)
+
+
+def roll_distribution(modified_dice: int = 0, extra_d6: bool = False, flat_modifier: int = 0) -> dict:
+    """
+    Enumerate every ordered roll of 2 + |modified_dice| d6 (plus the extra die), keeping the two
+    highest dice on advantage and the two lowest on disadvantage.
+    """
+    num_dice = 2 + abs(modified_dice)
+    extra_dice = 1 if extra_d6 else 0
+    outcomes = Counter()
+    for roll in product(FACES, repeat=num_dice + extra_dice):
+        dice, extra = sorted(roll[:num_dice]), roll[num_dice:]
+        kept = dice[-2:] if modified_dice >= 0 else dice[:2]
+        outcomes[sum(kept) + sum(extra) + flat_modifier] += 1
+    total = 6 ** (num_dice + extra_dice)
+    return {outcome: Fraction(count, total) for outcome, count in outcomes.items()}
+
+
+def dice_distribution(count: int, sides: int, keep: int = None, keep_highest: bool = True, reroll: int = 0) -> dict:
+    """
+    Enumerate every ordered roll of `count` dice, each first roll of `reroll` or less replaced by a
+    second roll, and sum the `keep` highest (or lowest) dice.
+    """
+    die = Counter()
+    for first, second in product(range(1, sides + 1), repeat=2):
+        die[first if first > reroll else second] += Fraction(1, sides * sides)
+
+    outcomes = Counter()
+    for roll in product(die.items(), repeat=count):
+        probability = Fraction(1)
+        for _, p in roll:
+            probability *= p
+        dice = sorted(face for face, _ in roll)
+        kept = dice if keep is None else dice[-keep:] if keep_highest else dice[:keep]
+        outcomes[sum(kept)] += probability
+    return dict(outcomes)
+
+
+def success_distribution(modified_dice: int, num_rolls: int, extra_d6: bool, flat_modifier: int, threshold: int) -> dict:
+    """
+    Enumerate every ordered sequence of `num_rolls` roll results and count the successes.
+    """
+    single = roll_distribution(modified_dice, extra_d6, flat_modifier)
+    successes = Counter()
+    for sequence in product(single.items(), repeat=num_rolls):
+        probability = Fraction(1)
+        for _, p in sequence:
+            probability *= p
+        successes[sum(outcome >= threshold for outcome, _ in sequence)] += probability
+    return {k: successes[k] for k in range(num_rolls + 1)}
+
+
+def mixed_success_distribution(profiles: list) -> dict:
+    """
+    Combine the enumerated success distributions of every profile, one (hits, probability) pair each.
+    """
+    successes = {0: Fraction(1)}
+    for profile in profiles:
+        single = success_distribution(
+            profile["modified_dice"], profile["num_rolls"], profile["extra_d6"],
+            profile["flat_modifier"], profile["threshold"]
+        )
+        combined = Counter()
+        for (hits, p), (more, q) in product(successes.items(), single.items()):
+            combined[hits + more] += p * q
+        successes = dict(combined)
+    return successes
+
+
+def injury_outcome(hit_distribution: dict, injury_params: dict, thresholds: dict) -> dict:
+    """
+    Resolve every ordered sequence of injury rolls for each number of hits.
+
+    Rolls without effect are re-rolled, i.e. the roll is conditioned on having an effect.
+    A blood marker result adds one marker; a downed result downs the unit with one marker,
+    or adds two to a unit that is already downed (has markers); Out of Action ends the sequence.
+    Downed units roll one extra injury die.
+    """
+    def has_effect(roll: int) -> bool:
+        return roll > thresholds["no_effect"] and (
+            thresholds["blood_marker"][0] <= roll <= thresholds["blood_marker"][1]
+            or thresholds["downed"][0] <= roll <= thresholds["downed"][1]
+            or roll >= thresholds["out_of_action"]
+        )
+
+    rolls = {}
+    for is_downed in (False, True):
+        distribution = roll_distribution(
+            injury_params["modified_dice"] + (1 if is_downed else 0),
+            injury_params["extra_d6"],
+            injury_params["flat_modifier"],
+        )
+        effective = {roll: p for roll, p in distribution.items() if has_effect(roll)}
+        total = sum(effective.values())
+        rolls[is_downed] = {roll: p / total for roll, p in effective.items()}
+
+    def resolve(markers: int, hits_left: int, probability: Fraction, result: Counter):
+        if hits_left == 0:
+            result[markers] += probability
+            return
+        for roll, p in rolls[markers > 0].items():
+            low, high = thresholds["blood_marker"]
+            if low <= roll <= high:
+                resolve(markers + 1, hits_left - 1, probability * p, result)
+            elif thresholds["downed"][0] <= roll <= thresholds["downed"][1]:
+                resolve(markers + (2 if markers > 0 else 1), hits_left - 1, probability * p, result)
+            else:
+                result["out_of_action"] += probability * p
+
+    combined = Counter()
+    for hits, hit_probability in hit_distribution.items():
+        resolve(0, hits, Fraction(hit_probability), combined)
+    total = sum(combined.values())
+    out_of_action = combined.pop("out_of_action", Fraction(0))
+    return {
+        "blood_marker_distribution": {markers: p / total for markers, p in combined.items() if p > 0},
+        "out_of_action_probability": out_of_action / total,
+    }
@@ -0,0 +1,333 @@
+"""
+Benchmark and regression suite for the dice math and the math API routes.
+
+1. Correctness: the math functions are compared against brute-force ordered enumeration
+   (`reference.py`), so a speedup can't quietly change a probability.
+2. Micro-benchmarks over the parameter grid, with cold (cache cleared) and warm caches.
+3. Endpoint benchmarks through the in-process ASGI test client.
+4. With `--tables DIR`, the checks and cold cases again, served from precomputed tables
+   (`python -m backend.tables`).
+
+Timings are compared with `baseline.json`; the run fails when a case is slower than its
+baseline by more than `--threshold`. Baselines are machine-specific, so refresh them with
+`--update-baseline` when moving to different hardware. Run from the repository root:
+
+    python -m backend.benchmarks.run
+    python -m backend.benchmarks.run --update-baseline
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+from backend.dice import DICE_CACHE, DiceExpressionError
+from backend.tables import load_tables
+from backend.trench_crusade_math import (
+    DISTRIBUTION_CACHE,
+    compute,
+    compute_attack,
+    compute_batch,
+    compute_expression,
+    compute_injury_outcome_refined,
+    compute_mixed_success_distribution,
+    compute_success_distribution,
+    injury_thresholds,
+    use_precomputed_tables,
+)
+from . import reference
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+TOLERANCE = 1e-12
+
+
+# Correctness
+
+def _close(actual: dict, expected: dict) -> bool:
+    keys = set(actual) | set(expected)
+    return all(abs(float(actual.get(k, 0.0)) - float(expected.get(k, 0))) <= TOLERANCE for k in keys)
+
+
+def check_correctness() -> list:
+    """
+    Returns:
+        list: A description of every mismatch with the brute-force reference.
+    """
+    failures = []
+
+    for dice in range(-3, 4):
+        for extra_d6 in (False, True):
+            for flat_modifier in (-2, 0, 3):
+                expected = reference.roll_distribution(dice, extra_d6, flat_modifier)
+                if not _close(compute(dice, extra_d6, flat_modifier), expected):
+                    failures.append(f"compute({dice}, {extra_d6}, {flat_modifier})")
+
+    for expression, args in {
+        "3d6kh3": (3, 6, None), "5d6kh3": (5, 6, 3), "4d4kl2": (4, 4, 2, False),
+        "3d6r1kh2": (3, 6, 2, True, 1), "2d6r2": (2, 6, None, True, 2), "d3": (1, 3),
+    }.items():
+        if not _close(compute_expression(expression), reference.dice_distribution(*args)):
+            failures.append(f"compute_expression({expression!r})")
+
+    # Expressions that would take seconds to minutes are refused up front (a 422 from /compute_expression)
+    for expression in ("20d100!kh10", "40d100!kh20", "100d100!+100d100!+100d100!"):
+        try:
+            compute_expression(expression)
+            failures.append(f"compute_expression({expression!r}) was not rejected")
+        except DiceExpressionError:
+            pass
+
+    for dice in (-2, 0, 1):
+        for num_rolls in (0, 1, 2, 3):
+            for threshold in (4, 7, 10):
+                expected = reference.success_distribution(dice, num_rolls, False, 0, threshold)
+                actual = compute_success_distribution(dice, num_rolls, False, 0, threshold)
+                if not _close(actual, expected):
+                    failures.append(f"compute_success_distribution({dice}, {num_rolls}, threshold={threshold})")
+
+    volleys = [
+        [(0, 2, False, 0, 7)],
+        [(1, 2, False, 0, 8), (-1, 1, True, 2, 9), (0, 0, False, 0, 7)],
+        [(0, 1, False, 0, 4), (2, 1, False, -1, 10), (0, 2, True, 0, 12)],
+    ]
+    for volley in volleys:
+        profiles = [
+            dict(zip(("modified_dice", "num_rolls", "extra_d6", "flat_modifier", "threshold"), profile))
+            for profile in volley
+        ]
+        expected = reference.mixed_success_distribution(profiles)
+        pmf = compute_mixed_success_distribution(profiles)["pmf"]
+        if not _close(dict(enumerate(pmf.tolist())), expected):
+            failures.append(f"compute_mixed_success_distribution({volley})")
+
+    hit_distributions = [{0: 1.0}, {1: 1.0}, {0: 0.1, 1: 0.2, 2: 0.3, 3: 0.4}, {2: 0.5, 4: 0.5}]
+    for dice in (-1, 0, 1):
+        for flat_modifier in (-2, 0, 2):
+            injury_params = {"modified_dice": dice, "extra_d6": False, "flat_modifier": flat_modifier}
+            for hit_distribution in hit_distributions:
+                expected = reference.injury_outcome(hit_distribution, injury_params, injury_thresholds)
+                actual = compute_injury_outcome_refined(hit_distribution, injury_params, injury_thresholds)
+                if not (
+                    _close(actual["blood_marker_distribution"], expected["blood_marker_distribution"])
+                    and abs(actual["out_of_action_probability"] - float(expected["out_of_action_probability"])) <= TOLERANCE
+                ):
+                    failures.append(f"compute_injury_outcome_refined({hit_distribution}, {injury_params})")
+
+    # The batch path must agree with the same chain fed by the brute-force hit distribution
+    hit_params = {"modified_dice": 1, "extra_d6": False, "flat_modifier": 0, "threshold": 8, "num_rolls": 3}
+    injury_params = {"modified_dice": 0, "extra_d6": True, "flat_modifier": -1}
+    hits = reference.success_distribution(1, 3, False, 0, 8)
+    expected = reference.injury_outcome(hits, injury_params, injury_thresholds)
+    actual = compute_attack(hit_params, injury_params, injury_thresholds)
+    if not (
+        _close(actual["success_distribution"], hits)
+        and _close(actual["blood_marker_distribution"], expected["blood_marker_distribution"])
+        and abs(actual["out_of_action_probability"] - float(expected["out_of_action_probability"])) <= TOLERANCE
+    ):
+        failures.append(f"compute_attack({hit_params}, {injury_params})")
+
+    return failures
+
+
+# Timing
+
+def measure(fn, repeat: int, min_seconds: float = 0.1) -> float:
+    """
+    Best per-call time over `repeat` rounds, each looping long enough to be measurable.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds or number >= 1 << 16:
+            break
+        number *= 2
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def cold(fn):
+    def run():
+        DISTRIBUTION_CACHE.clear()
+        DICE_CACHE.clear()
+        fn()
+    return run
+
+
+def long_tail_hits(max_hits: int) -> dict:
+    # Geometric tail over 0..max_hits, as from many attacks with a low hit chance
+    probabilities = 0.8 ** np.arange(max_hits + 1)
+    probabilities /= probabilities.sum()
+    return {hits: float(p) for hits, p in enumerate(probabilities)}
+
+
+def math_cases() -> dict:
+    injury_params = {"modified_dice": 0, "extra_d6": False, "flat_modifier": 0}
+
+    def compute_grid():
+        for dice in range(-3, 4):
+            for extra_d6 in (False, True):
+                for flat_modifier in range(-3, 4):
+                    compute(dice, extra_d6, flat_modifier)
+
+    grid = [
+        (dice, extra_d6, flat_modifier, threshold, num_rolls)
+        for dice in range(-3, 4) for extra_d6 in (False, True) for flat_modifier in (-1, 0, 1)
+        for threshold in (5, 7, 9) for num_rolls in (1, 5, 10, 25, 50)
+    ]
+    columns = {name: [row[i] for row in grid] for i, name in enumerate(("modified_dice", "extra_d6", "flat_modifier", "threshold", "num_rolls"))}
+    batch = dict(columns, injury_modified_dice=[0] * len(grid), injury_extra_d6=[False] * len(grid), injury_flat_modifier=[0] * len(grid))
+
+    cases = {
+        "compute/grid/cold": cold(compute_grid),
+        "compute/grid/warm": compute_grid,
+        "compute_batch/630_rows/cold": cold(lambda: compute_batch(**batch, thresholds=injury_thresholds)),
+        "compute_attack/50_rolls/cold": cold(lambda: compute_attack(
+            {"modified_dice": 1, "threshold": 7, "num_rolls": 50}, injury_params, injury_thresholds)),
+    }
+    for num_rolls in (1, 10, 50):
+        cases[f"compute_success_distribution/{num_rolls}_rolls/cold"] = cold(
+            lambda num_rolls=num_rolls: compute_success_distribution(1, num_rolls, False, 0, 7))
+    for expression in ("4d6kh2+1d6", "6d6kh3+2", "3d6r1!kh2"):
+        cases[f"compute_expression/{expression}/cold"] = cold(lambda expression=expression: compute_expression(expression))
+    # A mixed volley: 36 rolls over 12 profiles
+    volley = [
+        {"modified_dice": dice, "extra_d6": extra_d6, "flat_modifier": 0, "threshold": threshold, "num_rolls": 3}
+        for dice in (-1, 0, 1) for extra_d6 in (False, True) for threshold in (7, 9)
+    ]
+    cases["compute_mixed_success_distribution/volley/cold"] = cold(lambda: compute_mixed_success_distribution(volley))
+    cases["compute_mixed_success_distribution/volley/warm"] = lambda: compute_mixed_success_distribution(volley)
+    cases["compute_success_distribution/50_rolls/warm"] = lambda: compute_success_distribution(1, 50, False, 0, 7)
+    for max_hits in (3, 50):
+        hits = long_tail_hits(max_hits)
+        cases[f"compute_injury_outcome_refined/{max_hits}_hits/cold"] = cold(
+            lambda hits=hits: compute_injury_outcome_refined(hits, injury_params, injury_thresholds))
+        cases[f"compute_injury_outcome_refined/{max_hits}_hits/warm"] = (
+            lambda hits=hits: compute_injury_outcome_refined(hits, injury_params, injury_thresholds))
+    return cases
+
+
+def api_cases() -> dict:
+    # Only the math routes are needed, which also keeps the database and lore stack out of the way
+    os.environ.setdefault("APP_MODE", "math")
+    os.environ.setdefault("PREWARM_DISTRIBUTION_CACHE", "false")
+    from fastapi.testclient import TestClient
+    from backend.main import app
+
+    client = TestClient(app)
+    hits = {str(k): v for k, v in long_tail_hits(50).items()}
+    requests = {
+        "api/compute_distribution": ("/compute_distribution", {"modified_dice": 2, "extra_d6": True, "flat_modifier": 1}),
+        "api/compute_success_distribution": ("/compute_success_distribution", {"modified_dice": 1, "num_rolls": 50}),
+        "api/compute_injury_outcome": ("/compute_injury_outcome", {
+            "hit_distribution": hits, "injury_params": {"modified_dice": 0, "extra_d6": False, "flat_modifier": 0}}),
+        "api/compute_attack": ("/compute_attack", {"hit_params": {"modified_dice": 1, "num_rolls": 20}}),
+        "api/compute_mixed_success_distribution": ("/compute_mixed_success_distribution", {"profiles": [
+            {"modified_dice": dice, "threshold": threshold, "num_rolls": 4} for dice in (-1, 0, 1) for threshold in (7, 9)]}),
+        "api/compute_batch": ("/compute/batch", {"grid": {"modified_dice": list(range(-3, 4)), "num_rolls": [1, 10, 50]}}),
+    }
+
+    def post(path, body):
+        response = client.post(path, json=body)
+        response.raise_for_status()
+
+    # Routes serve warm caches in steady state, which is what these measure
+    return {name: (lambda path=path, body=body: post(path, body)) for name, (path, body) in requests.items()}
+
+
+# Baseline
+
+def load_baseline() -> dict:
+    try:
+        with open(BASELINE_PATH) as f:
+            return json.load(f)["results"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def save_baseline(results: dict):
+    with open(BASELINE_PATH, "w") as f:
+        json.dump({
+            "machine": {"python": platform.python_version(), "platform": platform.platform(), "numpy": np.__version__},
+            "results": results,
+        }, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run the correctness checks and benchmarks.")
+    parser.add_argument("--threshold", type=float, default=1.0, help="Allowed slowdown over the baseline (1.0 = twice as slow).")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this.")
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--tables", help="Also check and time lookups from the precomputed tables in this directory.")
+    parser.add_argument("--update-baseline", action="store_true", help="Record the timings as the new baseline.")
+    args = parser.parse_args(argv)
+
+    # Without --tables everything is computed live, even if USE_MATH_TABLES is set
+    use_precomputed_tables(None)
+    failures = check_correctness()
+    tables = None
+    if args.tables:
+        tables = load_tables(args.tables)
+        if tables is None:
+            parser.error(f"No usable tables in {args.tables}")
+        use_precomputed_tables(tables)
+        failures += [f"{failure} (tables)" for failure in check_correctness()]
+        use_precomputed_tables(None)
+    for failure in failures:
+        print(f"MISMATCH {failure}")
+    print(f"Correctness: {'FAILED' if failures else 'ok'}")
+
+    cases = math_cases()
+    if not args.skip_api:
+        cases.update(api_cases())
+    if tables is not None:
+        def with_tables(fn):
+            def run():
+                use_precomputed_tables(tables)
+                try:
+                    fn()
+                finally:
+                    use_precomputed_tables(None)
+            return run
+        # Switching tables clears the cache, so these are cold lookups
+        cases.update({f"{name[:-len('/cold')]}/table": with_tables(fn) for name, fn in math_cases().items() if name.endswith("/cold")})
+    cases = {name: fn for name, fn in cases.items() if args.filter in name}
+
+    baseline = load_baseline()
+    results, regressions = {}, []
+    for name, fn in cases.items():
+        seconds = measure(fn, args.repeat)
+        results[name] = seconds
+        line = f"{name:<50} {seconds * 1e6:12.1f} us"
+        if name in baseline:
+            ratio = seconds / baseline[name]
+            line += f"   {ratio:5.2f}x baseline"
+            if ratio > 1 + args.threshold:
+                regressions.append(name)
+                line += "   REGRESSION"
+        print(line)
+
+    if args.update_baseline:
+        save_baseline({**baseline, **results})
+        print(f"Baseline written to {BASELINE_PATH}")
+    elif regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+
+    return 1 if failures or (regressions and not args.update_baseline) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
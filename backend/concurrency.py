@@ -0,0 +1,150 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+
+class Saturated(Exception):
+    """
+    Raised when a limiter can't take more work. Carries the HTTP status to answer with
+    and a hint for when to retry.
+    """
+
+    def __init__(self, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into one execution whose result they all share.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        """
+        Await `fn()` unless a call with the same key is already in flight, in which case await that one.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+        # One caller going away must not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        self._calls.pop(key, None)
+        # Every waiter may have been cancelled; mark the outcome as seen so it isn't logged as lost
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "executions": self.executions, "coalesced": self.coalesced}
+
+
+class ConcurrencyLimiter:
+    """
+    Bound the number of concurrent calls, with a bounded queue of waiting callers.
+
+    Callers arriving to a full queue are rejected right away (429); callers that wait longer
+    than `queue_timeout` seconds give up (503). Both carry a retry hint derived from the
+    recent call latency.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait_seconds = 0.0
+        # Exponentially weighted moving average of the call duration
+        self.average_seconds = 1.0
+
+    def retry_after(self) -> int:
+        backlog = (self.waiting + 1) / self.max_concurrency
+        return max(1, math.ceil(backlog * self.average_seconds))
+
+    def ensure_capacity(self):
+        # Callers still acquiring a free slot count as waiting, so compare against slots plus queue
+        if self.active + self.waiting >= self.max_concurrency + self.max_queue:
+            self.rejected += 1
+            raise Saturated(429, self.retry_after(), "Too many concurrent requests, retry later")
+
+    @asynccontextmanager
+    async def slot(self):
+        self.ensure_capacity()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        queued_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise Saturated(503, self.retry_after(), "Timed out waiting for capacity, retry later")
+        finally:
+            self.waiting -= 1
+            self.total_wait_seconds += time.perf_counter() - queued_at
+
+        self.active += 1
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.average_seconds = 0.8 * self.average_seconds + 0.2 * (time.perf_counter() - started_at)
+            self.active -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "total_wait_seconds": self.total_wait_seconds,
+            "average_call_seconds": self.average_seconds,
+        }
+
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` acquisitions per second on average, in bursts of up to `burst`.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
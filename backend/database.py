@@ -1,21 +1,126 @@
-
+import logging
 import os
+import threading
+import time
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from dotenv import load_dotenv
 
+from .metrics import register_collector
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+# Connection pool settings, shared by the sync and async engines
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Test connections on checkout, and replace them before the server or a proxy drops them
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_database_url(url: str) -> str:
+    """
+    The async driver variant of a database URL: asyncpg for PostgreSQL, aiosqlite for SQLite.
+    """
+    url = make_url(url)
+    backend = url.drivername.split("+")[0]
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {url.drivername}; set ASYNC_DATABASE_URL")
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def pool_options(url: str) -> dict:
+    # In-memory SQLite lives in a single connection, so it can't be pooled
+    if make_url(url).get_backend_name() == "sqlite" and make_url(url).database in (None, "", ":memory:"):
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
+
+class PoolStats:
+    """
+    How long checkouts waited for a pooled connection.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "total_wait_seconds": self.total_wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+                "average_wait_seconds": self.total_wait_seconds / self.checkouts if self.checkouts else 0.0,
+            }
+
+
+ASYNC_POOL_STATS = PoolStats()
+register_collector(lambda: {
+    "trenchmath_db_pool_checkouts_total": ("counter", "Connections checked out of the async pool.", {(): ASYNC_POOL_STATS.checkouts}),
+    "trenchmath_db_pool_wait_seconds_total": ("counter", "Time spent waiting for pooled connections.", {(): ASYNC_POOL_STATS.total_wait_seconds}),
+})
+
+
+# SQLAlchemy names pool loggers after the pool class, which would put pool events under this
+# package's logger; keep them at the level sqlalchemy.pool logging would have
+logging.getLogger(f"{__name__}.TimedAsyncQueuePool").setLevel(logging.WARNING)
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            ASYNC_POOL_STATS.record(time.perf_counter() - start)
+
+
+# The sync engine serves create_all, migrations and the background workers' short transactions
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+_async_pool_options = pool_options(ASYNC_DATABASE_URL)
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    **_async_pool_options,
+    **({"poolclass": TimedAsyncQueuePool} if _async_pool_options else {})
+)
+# Objects stay usable after commit, since lazy refreshes aren't possible on async sessions
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
+def pool_stats() -> dict:
+    pool = async_engine.pool
+    stats = {"pool": pool.status(), "wait": ASYNC_POOL_STATS.stats()}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+    return stats
@@ -0,0 +1,323 @@
+"""
+Dice expressions compiled to exact probability distributions.
+
+Syntax (case and whitespace are ignored):
+
+    expression := ["+" | "-"] term (("+" | "-") term)*
+    term       := dice | integer
+    dice       := [count] "d" sides modifier*
+    modifier   := "r" N           re-roll results of N or less, once
+                | "!"             a maximum roll adds another roll, up to EXPLODE_DEPTH times
+                | "kh" K | "k" K  keep the K highest dice
+                | "kl" K          keep the K lowest dice
+
+For example "2d6", "3d6kh2+1d6+1", "2d6r1", "d6!" or "d3+2". The game's standard roll
+with two dice of advantage and the extra die is "4d6kh2+1d6".
+
+An expression compiles to a plan: its dice terms in canonical order plus a constant.
+Distributions are (pmf, offset) pairs, where pmf[i] is the probability of i + offset, and
+are cached per dice term and per prefix of the plan, so expressions sharing terms (such as
+"4d6kh2" and "4d6kh2+1d6") reuse each other's work.
+"""
+import functools
+import os
+import re
+from math import comb
+from typing import NamedTuple
+
+import numpy as np
+
+from .cache import LRUCache
+from .metrics import register_cache
+
+DICE_CACHE = LRUCache(maxsize=int(os.getenv("DICE_CACHE_SIZE", "4096")))
+register_cache("dice", DICE_CACHE)
+
+MAX_TERMS = 20
+MAX_DICE = 100
+MAX_SIDES = 100
+# Explosions chain at most this many extra rolls; the remaining tail is below 1e-7 for a d6
+EXPLODE_DEPTH = 10
+# Estimated multiply-adds an expression may take to compute, a few seconds' worth
+MAX_WORK = 10 ** 10
+
+TERM_RE = re.compile(r"([+-])(?:(\d*)d(\d+)((?:r\d+|!|k[hl]?\d+)*)|(\d+))")
+MODIFIER_RE = re.compile(r"r(\d+)|(!)|k([hl]?)(\d+)")
+
+
+class DiceExpressionError(ValueError):
+    pass
+
+
+def _memoized(fn):
+    """
+    Memoize `fn` in DICE_CACHE on its positional arguments as given.
+
+    Unlike `cache.cached` this skips binding and normalizing the arguments; every argument
+    here is already a hashable int, string or tuple, and the overhead would be paid on each
+    of the few layers a cold roll goes through.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args):
+        key = (fn.__name__, args)
+        result = DICE_CACHE.get(key)
+        if result is None:
+            result = fn(*args)
+            DICE_CACHE.set(key, result)
+        return result
+
+    wrapper.uncached = fn
+    return wrapper
+
+
+class DiceTerm(NamedTuple):
+    count: int
+    sides: int
+    reroll: int = 0
+    explode: bool = False
+    # Number of dice kept; None keeps them all
+    keep: int = None
+    keep_highest: bool = True
+    negative: bool = False
+
+    def __str__(self) -> str:
+        text = f"{self.count}d{self.sides}"
+        if self.reroll:
+            text += f"r{self.reroll}"
+        if self.explode:
+            text += "!"
+        if self.keep is not None:
+            text += f"k{'h' if self.keep_highest else 'l'}{self.keep}"
+        return text
+
+
+class DicePlan(NamedTuple):
+    terms: tuple
+    constant: int = 0
+
+    def __str__(self) -> str:
+        text = "".join(f"{'-' if term.negative else '+'}{term}" for term in self.terms)
+        if self.constant or not self.terms:
+            text += f"{self.constant:+d}"
+        return text.lstrip("+")
+
+
+def _parse_term(sign: str, count: str, sides: str, modifiers: str) -> DiceTerm:
+    count = int(count) if count else 1
+    sides = int(sides)
+    if not 1 <= count <= MAX_DICE:
+        raise DiceExpressionError(f"Dice count must be between 1 and {MAX_DICE}")
+    if not 1 <= sides <= MAX_SIDES:
+        raise DiceExpressionError(f"Dice must have between 1 and {MAX_SIDES} sides")
+
+    reroll, explode, keep, keep_highest, seen = 0, False, None, True, set()
+    for match in MODIFIER_RE.finditer(modifiers):
+        kind = "r" if match.group(1) else "!" if match.group(2) else "k"
+        if kind in seen:
+            raise DiceExpressionError(f"Modifier {kind!r} given twice")
+        seen.add(kind)
+        if kind == "r":
+            reroll = int(match.group(1))
+            if reroll >= sides:
+                raise DiceExpressionError("Re-rolling every result never ends")
+        elif kind == "!":
+            if sides < 2:
+                raise DiceExpressionError("A one-sided die can't explode")
+            explode = True
+        else:
+            keep, keep_highest = int(match.group(4)), match.group(3) != "l"
+            if not 1 <= keep <= count:
+                raise DiceExpressionError(f"Can't keep {keep} of {count} dice")
+
+    # Keeping every die is a plain sum
+    if keep == count:
+        keep, keep_highest = None, True
+    return DiceTerm(count, sides, reroll, explode, keep, keep_highest, sign == "-")
+
+
+def _die_length(term: DiceTerm) -> int:
+    # Each explosion shifts the chain by another `sides`
+    return term.sides * (EXPLODE_DEPTH + 1) if term.explode else term.sides
+
+
+def _term_length(term: DiceTerm) -> int:
+    return (term.count if term.keep is None else term.keep) * (_die_length(term) - 1) + 1
+
+
+def _term_work(term: DiceTerm) -> int:
+    """
+    Rough multiply-add count of `term_pmf`: the halving convolutions of a plain sum, or for kept
+    dice a convolution per face per kept die, each as long as the dice kept so far.
+    """
+    length = _die_length(term)
+    if term.keep is not None:
+        return length ** 3 * term.keep ** 2 // 2
+    return (term.count * length) ** 2 // 2 if term.count > 1 else 0
+
+
+def estimated_work(terms: tuple) -> int:
+    """
+    Rough multiply-add count of evaluating a plan's terms: each distinct term once, plus the
+    convolution of every term onto the sum of those before it.
+    """
+    work = sum(_term_work(term) for term in set(terms))
+    prefix_length = 0
+    for term in terms:
+        if prefix_length:
+            work += prefix_length * _term_length(term)
+        prefix_length += _term_length(term) - 1
+    return work
+
+
+@_memoized
+def compile_expression(expression: str) -> DicePlan:
+    """
+    Parse a dice expression into its canonical plan.
+
+    Raises:
+        DiceExpressionError: If the expression is malformed or out of bounds.
+    """
+    text = "".join(expression.split()).lower()
+    if not text:
+        raise DiceExpressionError("Empty dice expression")
+    if text[:1] not in ("+", "-"):
+        text = "+" + text
+
+    terms, constant, position = [], 0, 0
+    while position < len(text):
+        match = TERM_RE.match(text, position)
+        if match is None:
+            raise DiceExpressionError(f"Invalid dice expression at {text[position:]!r}")
+        sign, count, sides, modifiers, number = match.groups()
+        if number is not None:
+            constant += int(number) if sign == "+" else -int(number)
+        else:
+            terms.append(_parse_term(sign, count, sides, modifiers))
+        position = match.end()
+
+    if len(terms) > MAX_TERMS:
+        raise DiceExpressionError(f"Expressions are limited to {MAX_TERMS} dice terms")
+    # Exploding and kept dice grow the distributions fast, so bound the work as well as the sizes
+    if estimated_work(terms) > MAX_WORK:
+        raise DiceExpressionError("Expression is too large to compute exactly")
+    # Addition commutes, so sorting the terms lets reordered expressions share cached prefixes
+    return DicePlan(tuple(sorted(terms, key=lambda term: (term.negative, str(term)))), constant)
+
+
+def _frozen(pmf: np.ndarray) -> np.ndarray:
+    pmf.setflags(write=False)
+    return pmf
+
+
+def _convolve(a: tuple, b: tuple) -> tuple:
+    return np.convolve(a[0], b[0]), a[1] + b[1]
+
+
+@_memoized
+def die_pmf(sides: int, reroll: int = 0, explode: bool = False) -> tuple:
+    """
+    Distribution of a single die, re-rolling results up to `reroll` once and exploding on
+    the maximum if `explode` is set.
+    """
+    pmf = np.full(sides, 1 / sides)
+    if reroll:
+        # A low result is replaced by the re-roll, whatever it shows
+        pmf[:reroll] = 0.0
+        pmf += reroll / sides / sides
+
+    if explode:
+        # Each explosion shifts the chain by `sides`; the deepest roll doesn't explode again
+        single = pmf
+        for _ in range(EXPLODE_DEPTH):
+            exploded = np.zeros(sides + len(pmf))
+            exploded[:sides - 1] = single[:-1]
+            exploded[sides:] = single[-1] * pmf
+            pmf = exploded
+
+    return _frozen(pmf), 1
+
+
+def _keep_highest(pmf: np.ndarray, count: int, keep: int) -> np.ndarray:
+    """
+    Distribution of the sum of the `keep` highest of `count` independent dice, over sums of
+    face indices 0..keep * (len(pmf) - 1).
+
+    Sums over the face v of the keep-th highest die. With a < keep dice above v (their
+    distribution restricted to faces above v), at least keep - a of the rest showing v and
+    the others below it, the kept dice sum to the a dice above plus (keep - a) * v.
+    All faces v are handled at once, as rows of 2-d arrays.
+    """
+    length = keep * (len(pmf) - 1) + 1
+    faces = np.flatnonzero(pmf)
+    p = pmf[faces][:, None]
+    low = (np.cumsum(pmf) - pmf)[faces][:, None]
+    # Row v: the distribution of one die restricted to faces above v
+    upper = np.where(np.arange(len(pmf)) > faces[:, None], pmf, 0.0)
+
+    result = np.zeros(length)
+    above = np.ones((len(faces), 1))  # row v: distribution of the a dice above v, unnormalized
+    for a in range(keep):
+        free = count - a
+        b = np.arange(keep - a, free + 1)
+        combinations = np.array([comb(free, k) for k in b.tolist()], dtype=float)
+        weight = comb(count, a) * (combinations * p ** b * low ** (free - b)).sum(axis=1)
+
+        index = ((keep - a) * faces)[:, None] + np.arange(above.shape[1])
+        result += np.bincount(index.ravel(), (weight[:, None] * above).ravel(), minlength=length)
+        if a + 1 < keep:
+            above = upper if a == 0 else np.array([np.convolve(row, u) for row, u in zip(above, upper)])
+    return result
+
+
+def _keep_pmf(die: tuple, count: int, keep: int, keep_highest: bool) -> tuple:
+    """
+    Distribution of the sum of the `keep` highest (or lowest) of `count` independent dice.
+    """
+    pmf, offset = die
+    if keep_highest:
+        return _keep_highest(pmf, count, keep), keep * offset
+    # The lowest dice are the highest of the mirrored faces
+    return _keep_highest(pmf[::-1], count, keep)[::-1].copy(), keep * offset
+
+
+@_memoized
+def term_pmf(term: DiceTerm) -> tuple:
+    """
+    Distribution of one dice term, its sign included.
+    """
+    if term.negative:
+        pmf, offset = term_pmf(term._replace(negative=False))
+        return _frozen(pmf[::-1].copy()), -(offset + len(pmf) - 1)
+    die = die_pmf(term.sides, term.reroll, term.explode)
+    if term.keep is not None:
+        pmf, offset = _keep_pmf(die, term.count, term.keep, term.keep_highest)
+        return _frozen(pmf), offset
+    if term.count == 1:
+        return die
+    # Split the dice in halves, so that sums of many dice share their smaller sums
+    half = term.count // 2
+    pmf, offset = _convolve(term_pmf(term._replace(count=half)), term_pmf(term._replace(count=term.count - half)))
+    return _frozen(pmf), offset
+
+
+@_memoized
+def _prefix_pmf(terms: tuple) -> tuple:
+    if len(terms) == 1:
+        return term_pmf(terms[0])
+    pmf, offset = _convolve(_prefix_pmf(terms[:-1]), term_pmf(terms[-1]))
+    return _frozen(pmf), offset
+
+
+def evaluate(expression) -> tuple:
+    """
+    Exact distribution of a dice expression, or of an already compiled plan.
+
+    Returns:
+        tuple[np.ndarray, int]: (pmf, offset) where pmf[i] is the probability of a result of i + offset.
+                                The pmf is shared and read-only.
+    """
+    plan = compile_expression(expression) if isinstance(expression, str) else expression
+    if not plan.terms:
+        return _frozen(np.ones(1)), plan.constant
+    pmf, offset = _prefix_pmf(plan.terms)
+    return pmf, offset + plan.constant
@@ -1,44 +1,240 @@
+import asyncio
+import hashlib
+import json
+import logging
 import os
+import pickle
+import threading
+import time
+import typing
+from contextlib import contextmanager
+import faiss
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.runnables import RunnableLambda
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_community.callbacks import get_openai_callback
 from langchain_community.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.docstore.document import Document
 from dotenv import load_dotenv
 
+from .artifacts import build_lock, versioned_build
+from .concurrency import ConcurrencyLimiter, Saturated, SingleFlight
+from .embedding_cache import CachedEmbeddings
+from .lore_ingest import index_pdfs_streaming
+from .metrics import METRICS_ENABLED, counter, histogram, register_collector
+
 load_dotenv()
 
-# Example: gpt-4o-mini endpoint (adjust as needed)
-LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini") 
+logger = logging.getLogger(__name__)
+
+# Example: gpt-4o-mini endpoint (adjust as needed); "fake" answers locally after FAKE_LLM_LATENCY seconds
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "1.0"))
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# "fake" selects a deterministic local embedder, for offline testing and benchmarks
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+FAKE_EMBEDDING_SIZE = int(os.getenv("FAKE_EMBEDDING_SIZE", "1536"))
 
 # Directory with PDF lore documents
-LORE_PDF_DIR = "./backend/lore_pdfs"
+LORE_PDF_DIR = os.getenv("LORE_PDF_DIR", "./backend/lore_pdfs")
+# Prebuilt index artifact, shared read-only by all workers
+LORE_INDEX_DIR = os.getenv("LORE_INDEX_DIR", "./backend/lore_index")
+# Chunk embeddings kept across index builds
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./backend/embedding_cache.sqlite3")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+# Chunks embedded and added to the index at a time, and PDF parsing processes (CPU count if unset).
+# The default gives every concurrent embedding request a full batch.
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "0")) or EMBEDDING_BATCH_SIZE * EMBEDDING_CONCURRENCY
+LORE_INGEST_WORKERS = int(os.getenv("LORE_INGEST_WORKERS", "0")) or None
+
+CHUNK_SIZE = 2000
+CHUNK_OVERLAP = 200
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.pkl"
+MANIFEST_FILE = "manifest.json"
+
+
+def get_embeddings():
+    if EMBEDDING_MODEL == "fake":
+        return DeterministicFakeEmbedding(size=FAKE_EMBEDDING_SIZE)
+    return OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY, model=EMBEDDING_MODEL)
+
+
+def get_cached_embeddings() -> CachedEmbeddings:
+    return CachedEmbeddings(
+        get_embeddings(), EMBEDDING_MODEL, EMBEDDING_CACHE_PATH,
+        batch_size=EMBEDDING_BATCH_SIZE, max_concurrency=EMBEDDING_CONCURRENCY
+    )
+
 
 def load_and_index_pdfs(pdf_dir: str) -> FAISS:
-    # In production, you'd do this indexing once and store the index.
-    # For simplicity, we do it on startup. Consider caching or persisting.
-    docs = []
-    for file in os.listdir(pdf_dir):
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    embeddings = get_cached_embeddings()
+    vector_store, stats = index_pdfs_streaming(
+        pdf_dir, embeddings, text_splitter, batch_size=INDEX_BATCH_SIZE, workers=LORE_INGEST_WORKERS
+    )
+    logger.info("Embeddings loaded", extra={"embedding_cache": embeddings.stats()})
+    logger.info("Ingestion stages", extra={"stages": stats})
+
+    return vector_store
+
+
+def build_manifest(pdf_dir: str) -> dict:
+    """
+    Describe everything the index depends on: the content hash of every PDF plus the
+    embedding and splitting settings.
+    """
+    files = {}
+    for file in sorted(os.listdir(pdf_dir)):
         if file.endswith(".pdf"):
-            print(f"Loading file {file} to be embedded...")
-            loader = PyPDFLoader(os.path.join(pdf_dir, file))
-            pdf_docs = loader.load()
-            docs.extend(pdf_docs)
+            digest = hashlib.sha256()
+            with open(os.path.join(pdf_dir, file), "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            files[file] = digest.hexdigest()
+    return {
+        "files": files,
+        "embedding_model": EMBEDDING_MODEL,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+    }
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
-    splitted_docs = text_splitter.split_documents(docs)
 
-    embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-    vector_store = FAISS.from_documents(splitted_docs, embeddings)
-    print("Embeddings loaded...")
+def read_manifest(index_dir: str):
+    try:
+        with open(os.path.join(index_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-    return vector_store
 
-# Initialize vector store at startup
-VECTOR_STORE = load_and_index_pdfs(LORE_PDF_DIR)
+def build_lore_index(pdf_dir: str = LORE_PDF_DIR, index_dir: str = LORE_INDEX_DIR, force: bool = False) -> bool:
+    """
+    Build the on-disk lore index, unless the existing one was built from the same PDFs.
+
+    Each build is written to its own version directory and `index_dir` is a symlink flipped
+    to it afterwards (see `backend.artifacts`), so workers never load a half-written or
+    half-removed index. Concurrent builds of the same index wait for each other.
+
+    Returns:
+        bool: Whether the index was rebuilt.
+    """
+    manifest = build_manifest(pdf_dir)
+    if not force and read_manifest(index_dir) == manifest:
+        logger.info("Lore index is up to date")
+        return False
+
+    with build_lock(index_dir):
+        # Another process may have built the same index while this one waited for the lock
+        if not force and read_manifest(index_dir) == manifest:
+            logger.info("Lore index is up to date")
+            return False
+
+        vector_store = load_and_index_pdfs(pdf_dir)
+
+        with versioned_build(index_dir) as version_dir:
+            faiss.write_index(vector_store.index, os.path.join(version_dir, INDEX_FILE))
+            with open(os.path.join(version_dir, DOCSTORE_FILE), "wb") as f:
+                pickle.dump((vector_store.docstore, vector_store.index_to_docstore_id), f)
+            with open(os.path.join(version_dir, MANIFEST_FILE), "w") as f:
+                json.dump(manifest, f, indent=2)
+    logger.info("Lore index written", extra={"index_dir": index_dir, "version_dir": version_dir})
+    return True
+
+
+def load_lore_index(index_dir: str = LORE_INDEX_DIR) -> FAISS:
+    """
+    Load the prebuilt lore index read-only, memory-mapping the vectors where FAISS supports it
+    so that workers on the same host share the page cache.
+    """
+    # Resolved once, so all files come from the same version even if a build swaps in a new one
+    index_dir = os.path.realpath(index_dir)
+    index_path = os.path.join(index_dir, INDEX_FILE)
+    try:
+        index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        index = faiss.read_index(index_path, faiss.IO_FLAG_READ_ONLY)
+    with open(os.path.join(index_dir, DOCSTORE_FILE), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(get_embeddings(), index, docstore, index_to_docstore_id)
+
+
+VECTOR_STORE = None
+_vector_store_lock = threading.Lock()
+
+# Upstream LLM calls: identical in-flight calls are shared, and the total is bounded
+LLM_LIMITER = ConcurrencyLimiter(
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+    max_queue=int(os.getenv("LLM_MAX_QUEUE", "32")),
+    queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "30")),
+)
+LLM_SINGLE_FLIGHT = SingleFlight()
+
+LLM_CALL_SECONDS = histogram("trenchmath_llm_call_duration_seconds", "Upstream LLM call latency.", ("model", "schema"))
+LLM_TOKENS = counter("trenchmath_llm_tokens_total", "Tokens used by LLM calls.", ("model", "kind"))
+LLM_COST = counter("trenchmath_llm_cost_usd_total", "Estimated LLM spend in USD.", ("model",))
+RETRIEVAL_SECONDS = histogram("trenchmath_retrieval_duration_seconds", "FAISS similarity search latency.", ("mode",))
+register_collector(lambda: {
+    "trenchmath_llm_active_calls": ("gauge", "LLM calls in progress.", {(): LLM_LIMITER.active}),
+    "trenchmath_llm_queue_depth": ("gauge", "LLM calls waiting for a slot.", {(): LLM_LIMITER.waiting}),
+    "trenchmath_llm_rejected_total": ("counter", "LLM calls refused for a full queue.", {(): LLM_LIMITER.rejected}),
+})
+
+
+@contextmanager
+def track_llm_call(schema_name: str):
+    """
+    Record the latency, token usage and cost of the LLM calls made inside the block.
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    with get_openai_callback() as usage:
+        try:
+            yield
+        finally:
+            LLM_CALL_SECONDS.observe(time.perf_counter() - start, LLM_MODEL, schema_name)
+            LLM_TOKENS.inc(usage.prompt_tokens, LLM_MODEL, "prompt")
+            LLM_TOKENS.inc(usage.completion_tokens, LLM_MODEL, "completion")
+            LLM_COST.inc(usage.total_cost, LLM_MODEL)
+
+
+def _fake_value(annotation, name: str):
+    if isinstance(annotation, type) and hasattr(annotation, "model_fields"):
+        return annotation(**{field: _fake_value(info.annotation, field) for field, info in annotation.model_fields.items()})
+    if typing.get_origin(annotation) is list:
+        (item,) = typing.get_args(annotation)
+        return [_fake_value(item, f"{name} {i + 1}") for i in range(3)]
+    return f"Fake {name.replace('_', ' ')}"
+
+
+class FakeLLM:
+    """
+    Offline stand-in for the chat model: structured output calls return placeholder
+    instances of the schema after a fixed latency.
+    """
+
+    def __init__(self, latency: float = FAKE_LLM_LATENCY):
+        self.latency = latency
+
+    def with_structured_output(self, schema, **kwargs):
+        def respond(messages):
+            time.sleep(self.latency)
+            return _fake_value(schema, schema.__name__)
+
+        async def arespond(messages):
+            await asyncio.sleep(self.latency)
+            return _fake_value(schema, schema.__name__)
+
+        return RunnableLambda(respond, afunc=arespond)
+
 
 def get_llm():
+    if LLM_MODEL == "fake":
+        return FakeLLM()
     llm = ChatOpenAI(
         openai_api_key=OPENAI_API_KEY,
         model_name=LLM_MODEL,
@@ -48,4 +244,38 @@ def get_llm():
     return llm
 
 def get_vectorstore():
+    global VECTOR_STORE
+    if VECTOR_STORE is None:
+        with _vector_store_lock:
+            if VECTOR_STORE is None:
+                # Requests never build the index: that's the offline build step's or the startup hook's job
+                if read_manifest(LORE_INDEX_DIR) is None:
+                    raise Saturated(503, 30, "The lore index isn't built yet")
+                VECTOR_STORE = load_lore_index()
     return VECTOR_STORE
+
+
+def prepare_lore_index():
+    """
+    Build the lore index if there is none yet and load it, off the request path; run at startup.
+    Workers starting together build it once, the others wait for the build lock.
+    """
+    try:
+        if read_manifest(LORE_INDEX_DIR) is None:
+            build_lore_index()
+        get_vectorstore()
+    except Exception:
+        logger.exception("Preparing the lore index failed")
+
+
+if __name__ == "__main__":
+    import argparse
+    from .logging_config import configure_logging
+
+    configure_logging(names=(__package__, __name__))
+    parser = argparse.ArgumentParser(description="Build the on-disk lore index from the lore PDFs.")
+    parser.add_argument("--pdf-dir", default=LORE_PDF_DIR)
+    parser.add_argument("--index-dir", default=LORE_INDEX_DIR)
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the PDFs are unchanged.")
+    args = parser.parse_args()
+    build_lore_index(args.pdf_dir, args.index_dir, force=args.force)
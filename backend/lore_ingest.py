@@ -0,0 +1,120 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+
+class StageStats:
+    """
+    Item counts and busy time of one ingestion stage.
+    """
+    __slots__ = ("items", "seconds")
+
+    def __init__(self):
+        self.items = 0
+        self.seconds = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "items": self.items,
+            "seconds": self.seconds,
+            "items_per_second": self.items / self.seconds if self.seconds else None,
+        }
+
+
+def _load_pdf_pages(path: str) -> tuple[list, float]:
+    # Runs in a worker process; only one file's pages are held at a time
+    start = time.perf_counter()
+    pages = PyPDFLoader(path).load()
+    return pages, time.perf_counter() - start
+
+
+def iter_pdf_pages(pdf_dir: str, workers: int, stats: dict) -> Iterator[Document]:
+    """
+    Parse the PDFs in `pdf_dir` in a process pool and yield their pages in file order.
+
+    At most two files per worker are parsed ahead of the consumer, so memory stays bounded
+    by the in-flight files rather than the corpus.
+    """
+    paths = sorted(os.path.join(pdf_dir, file) for file in os.listdir(pdf_dir) if file.endswith(".pdf"))
+    files, pages = stats["parse_files"], stats["parse_pages"]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        paths = iter(paths)
+        for path in islice(paths, 2 * workers):
+            pending.append(pool.submit(_load_pdf_pages, path))
+        while pending:
+            file_pages, seconds = pending.popleft().result()
+            for path in islice(paths, 1):
+                pending.append(pool.submit(_load_pdf_pages, path))
+
+            files.items += 1
+            # Worker time summed over processes, so the rate is per core
+            files.seconds += seconds
+            pages.items += len(file_pages)
+            pages.seconds += seconds
+            yield from file_pages
+
+
+def iter_chunks(pages: Iterable[Document], text_splitter, stats: dict) -> Iterator[Document]:
+    split = stats["split"]
+    for page in pages:
+        start = time.perf_counter()
+        chunks = text_splitter.split_documents([page])
+        split.seconds += time.perf_counter() - start
+        split.items += len(chunks)
+        yield from chunks
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+def index_pdfs_streaming(pdf_dir: str, embeddings: Embeddings, text_splitter, batch_size: int = 256,
+                         workers: int = None) -> tuple[FAISS, dict]:
+    """
+    Stream the lore PDFs through parsing, splitting and embedding into a FAISS index.
+
+    Pages are parsed in parallel, split as they arrive and added to the index `batch_size`
+    chunks at a time, so peak memory is a few files and one batch rather than the corpus.
+
+    Args:
+        pdf_dir (str): Directory with the PDF lore documents.
+        embeddings (Embeddings): Embedder for the chunks.
+        text_splitter: Splitter turning pages into chunks.
+        batch_size (int): Number of chunks embedded and indexed at a time.
+        workers (int): Number of parsing processes, CPU count if None.
+
+    Returns:
+        tuple[FAISS, dict]: The index and per-stage throughput statistics.
+    """
+    workers = workers or os.cpu_count() or 1
+    stats = {stage: StageStats() for stage in ("parse_files", "parse_pages", "split", "index")}
+    start = time.perf_counter()
+
+    vector_store = None
+    chunks = iter_chunks(iter_pdf_pages(pdf_dir, workers, stats), text_splitter, stats)
+    for batch in batched(chunks, batch_size):
+        batch_start = time.perf_counter()
+        if vector_store is None:
+            vector_store = FAISS.from_documents(batch, embeddings)
+        else:
+            vector_store.add_documents(batch)
+        stats["index"].seconds += time.perf_counter() - batch_start
+        stats["index"].items += len(batch)
+
+    if vector_store is None:
+        raise ValueError(f"No lore PDFs with text found in {pdf_dir}")
+
+    summary = {stage: stage_stats.to_dict() for stage, stage_stats in stats.items()}
+    summary["total_seconds"] = time.perf_counter() - start
+    return vector_store, summary
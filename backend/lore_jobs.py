@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .auth import get_current_user
+from .concurrency import RateLimiter, Saturated
+from .database import AsyncSessionLocal, SessionLocal, get_db
+from .lore_routes import import_lore_module
+from .models import LoreJob, LoreJobItem, User
+from .utils import server_sent_event
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+# Items generated concurrently across all jobs
+LORE_JOB_WORKERS = int(os.getenv("LORE_JOB_WORKERS", "4"))
+# Generations started per minute across all jobs, so bulk jobs leave upstream budget for interactive requests
+LORE_JOB_RATE_PER_MINUTE = float(os.getenv("LORE_JOB_RATE_PER_MINUTE", "60"))
+MAX_JOB_ROSTERS = int(os.getenv("MAX_JOB_ROSTERS", "500"))
+LORE_JOB_POLL_INTERVAL = float(os.getenv("LORE_JOB_POLL_INTERVAL", "1.0"))
+# Attempts per item when the LLM limiter is saturated
+MAX_ITEM_ATTEMPTS = 5
+# A running item whose worker hasn't finished it within the lease is assumed lost and claimed again
+LORE_JOB_LEASE_SECONDS = float(os.getenv("LORE_JOB_LEASE_SECONDS", "900"))
+
+# Identifies this process's claims among all workers sharing the database
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+FINISHED = ("done", "error")
+
+_queue = None
+_workers = []
+_sweeper = None
+_rate_limiter = None
+
+
+def _claimable(now: datetime):
+    # Pending items, and running items whose worker let the lease expire (or that predate leases)
+    expired = or_(LoreJobItem.claimed_at.is_(None), LoreJobItem.claimed_at < now - timedelta(seconds=LORE_JOB_LEASE_SECONDS))
+    return or_(LoreJobItem.status == "pending", (LoreJobItem.status == "running") & expired)
+
+
+def _claim_item(item_id: int):
+    with SessionLocal() as db:
+        # A single conditional UPDATE, so of several workers racing for an item exactly one wins
+        now = datetime.utcnow()
+        claimed = db.execute(
+            update(LoreJobItem)
+            .where(LoreJobItem.id == item_id, _claimable(now))
+            .values(status="running", claimed_at=now, claimed_by=WORKER_ID)
+        ).rowcount
+        db.commit()
+        if claimed != 1:
+            return None
+        item = db.get(LoreJobItem, item_id)
+        return item.warband_text, item.job.theme_info
+
+
+def _finish_item(item_id: int, result: dict = None, error: str = None):
+    with SessionLocal() as db:
+        # Only the current claim holder may finish the item; after losing the lease the result is dropped
+        finished = db.execute(
+            update(LoreJobItem)
+            .where(LoreJobItem.id == item_id, LoreJobItem.status == "running", LoreJobItem.claimed_by == WORKER_ID)
+            .values(status="error" if error else "done", result=result, error=error, finished_at=datetime.utcnow())
+        ).rowcount
+        db.commit()
+    if finished != 1:
+        logger.warning("Lore job item was claimed by another worker", extra={"item_id": item_id})
+
+
+def _release_claims():
+    # Hand this process's unfinished items back, so another worker needn't wait for the lease
+    with SessionLocal() as db:
+        db.execute(
+            update(LoreJobItem)
+            .where(LoreJobItem.status == "running", LoreJobItem.claimed_by == WORKER_ID)
+            .values(status="pending", claimed_at=None, claimed_by=None)
+        )
+        db.commit()
+
+
+def _claimable_item_ids() -> list:
+    # Items nobody is working on: never started, or left running by a worker that went away; oldest first
+    with SessionLocal() as db:
+        rows = db.query(LoreJobItem.id).filter(_claimable(datetime.utcnow())).order_by(LoreJobItem.id)
+        return [item_id for (item_id,) in rows]
+
+
+async def _process_item(item_id: int):
+    warband_lore = await import_lore_module("warband_lore")
+
+    claimed = await asyncio.to_thread(_claim_item, item_id)
+    if claimed is None:
+        return
+    warband_text, theme_info = claimed
+
+    lore, error = None, None
+    for attempt in range(1, MAX_ITEM_ATTEMPTS + 1):
+        await _rate_limiter.acquire()
+        try:
+            lore = await warband_lore.agenerate_warband_lore(warband_text, theme_info)
+            break
+        except Saturated as e:
+            # Interactive traffic has the upstream capacity; back off rather than fail the item
+            if attempt == MAX_ITEM_ATTEMPTS:
+                error = e.detail
+            else:
+                await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            error = f"Lore generation failed: {e}"
+            break
+
+    if lore is not None and "error" in lore:
+        lore, error = None, f"{lore['error']}: {lore.get('details')}"
+    await asyncio.to_thread(_finish_item, item_id, lore, error)
+
+
+async def _worker():
+    while True:
+        item_id = await _queue.get()
+        try:
+            await _process_item(item_id)
+        except Exception:
+            logger.exception("Lore job item failed", extra={"item_id": item_id})
+        finally:
+            _queue.task_done()
+
+
+async def _requeue_claimable():
+    # Picks up items of processes that stopped mid-item; the claim keeps duplicates from running twice
+    while True:
+        await asyncio.sleep(LORE_JOB_LEASE_SECONDS)
+        try:
+            for item_id in await asyncio.to_thread(_claimable_item_ids):
+                _queue.put_nowait(item_id)
+        except Exception:
+            logger.exception("Requeueing lore job items failed")
+
+
+async def start_lore_job_workers():
+    """
+    Start the worker pool and queue the items no live worker holds, including those of a
+    previous process that didn't finish them within their lease.
+    """
+    global _queue, _rate_limiter, _sweeper
+    _queue = asyncio.Queue()
+    _rate_limiter = RateLimiter(LORE_JOB_RATE_PER_MINUTE / 60, burst=LORE_JOB_WORKERS)
+    for item_id in await asyncio.to_thread(_claimable_item_ids):
+        _queue.put_nowait(item_id)
+    _workers.extend(asyncio.create_task(_worker()) for _ in range(LORE_JOB_WORKERS))
+    _sweeper = asyncio.create_task(_requeue_claimable())
+
+
+async def stop_lore_job_workers():
+    # Unfinished items stay in the database, released for whichever worker runs next
+    tasks = _workers + ([_sweeper] if _sweeper is not None else [])
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _workers.clear()
+    await asyncio.to_thread(_release_claims)
+
+
+async def job_progress(db: AsyncSession, job_id: int) -> dict:
+    counts = dict((await db.execute(
+        select(LoreJobItem.status, func.count())
+        .where(LoreJobItem.job_id == job_id)
+        .group_by(LoreJobItem.status)
+    )).all())
+    total = sum(counts.values())
+    finished = sum(counts.get(status, 0) for status in FINISHED)
+    return {
+        "job_id": job_id,
+        "status": "done" if finished == total else "running",
+        "total_items": total,
+        **{status: counts.get(status, 0) for status in ("pending", "running", "done", "error")},
+    }
+
+
+def item_result(item: LoreJobItem) -> dict:
+    return {"position": item.position, "status": item.status, "lore": item.result, "error": item.error}
+
+
+async def _get_owned_job(db: AsyncSession, job_id: int, user: User) -> LoreJob:
+    job = await db.get(LoreJob, job_id)
+    if job is None or job.owner_id != user.id:
+        raise HTTPException(status_code=404, detail="Unknown lore job")
+    return job
+
+
+class LoreJobRequest(BaseModel):
+    rosters: list[str]
+    theme_info: Optional[str] = None
+
+@router.post("/warband_lore/jobs", status_code=202)
+async def create_lore_job(req: LoreJobRequest, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if not req.rosters:
+        raise HTTPException(status_code=422, detail="No rosters given")
+    if len(req.rosters) > MAX_JOB_ROSTERS:
+        raise HTTPException(status_code=422, detail=f"Jobs are limited to {MAX_JOB_ROSTERS} rosters")
+
+    job = LoreJob(theme_info=req.theme_info, owner_id=current_user.id)
+    items = [LoreJobItem(position=i, warband_text=text, job=job) for i, text in enumerate(req.rosters)]
+    db.add_all([job, *items])
+    await db.commit()
+
+    for item in items:
+        _queue.put_nowait(item.id)
+    return await job_progress(db, job.id)
+
+@router.get("/warband_lore/jobs/{job_id}")
+async def get_lore_job(job_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    # Partial results: finished items carry their lore, the rest only their status
+    job = await _get_owned_job(db, job_id, current_user)
+    items = await db.scalars(select(LoreJobItem).where(LoreJobItem.job_id == job.id).order_by(LoreJobItem.position))
+    return {**await job_progress(db, job.id), "items": [item_result(item) for item in items]}
+
+@router.get("/warband_lore/jobs/{job_id}/stream")
+async def stream_lore_job(job_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    await _get_owned_job(db, job_id, current_user)
+
+    async def events():
+        # Poll the database so progress is visible whichever process runs the items
+        sent, last_progress = set(), None
+        while True:
+            # The connection goes back to the pool before anything is sent to a slow client
+            async with AsyncSessionLocal() as session:
+                finished = (await session.scalars(
+                    select(LoreJobItem)
+                    .where(LoreJobItem.job_id == job_id, LoreJobItem.status.in_(FINISHED), LoreJobItem.id.notin_(sent))
+                    .order_by(LoreJobItem.finished_at)
+                )).all()
+                progress = await job_progress(session, job_id)
+            for item in finished:
+                sent.add(item.id)
+                yield server_sent_event("item", item_result(item))
+            if progress != last_progress:
+                yield server_sent_event("progress", progress)
+                last_progress = progress
+            if progress["status"] == "done":
+                break
+            await asyncio.sleep(LORE_JOB_POLL_INTERVAL)
+        yield server_sent_event("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
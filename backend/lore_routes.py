@@ -0,0 +1,83 @@
+import asyncio
+import importlib
+import logging
+import sys
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import Optional
+
+from .concurrency import Saturated
+from .roster import RosterError, parse_roster
+from .utils import server_sent_event
+
+# The lore subsystem (LangChain, LangGraph, FAISS) is imported on first use inside the
+# handlers, so that starting the API doesn't pay for it until lore is requested
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+
+async def import_lore_module(name: str):
+    # The first import of the lore stack takes seconds, so it runs in a thread rather than on the event loop
+    return await asyncio.to_thread(importlib.import_module, f"{__package__}.{name}")
+
+
+@router.post("/warband_lore")
+def save_warband_lore(lore: dict):
+    logger.debug("Received warband lore: %s", lore)
+    return {"message": "saved warband"}
+
+
+class RosterRequest(BaseModel):
+    text: str
+
+@router.post("/roster/parse")
+def roster_parse(req: RosterRequest):
+    try:
+        return parse_roster(req.text).to_dict()
+    except RosterError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+class WarbandLoreRequest(BaseModel):
+    warband_text: str
+    theme_info: Optional[str] = None
+    # Skip the lore cache and generate fresh options
+    regenerate: bool = False
+
+@router.post("/warband_lore/generate")
+async def warband_lore_generate(req: WarbandLoreRequest):
+    warband_lore = await import_lore_module("warband_lore")
+
+    logger.debug("Warband lore requested", extra={"warband_text": req.warband_text, "theme_info": req.theme_info})
+    lore = await warband_lore.agenerate_warband_lore(req.warband_text, req.theme_info, req.regenerate)
+    return lore
+
+@router.post("/warband_lore/stream")
+async def warband_lore_stream(req: WarbandLoreRequest):
+    llm = await import_lore_module("llm")
+    warband_lore = await import_lore_module("warband_lore")
+
+    # Reject before the stream starts, while an error status can still be sent
+    llm.LLM_LIMITER.ensure_capacity()
+
+    async def events():
+        try:
+            async for option in warband_lore.stream_warband_lore(req.warband_text, req.theme_info, req.regenerate):
+                yield server_sent_event("option", option)
+        except Saturated as e:
+            yield server_sent_event("error", {"error": e.detail, "retry_after": e.retry_after})
+        except Exception as e:
+            yield server_sent_event("error", {"error": "Lore generation failed", "details": str(e)})
+        yield server_sent_event("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.get("/llm_stats")
+def get_llm_stats():
+    # Reporting stats shouldn't be what loads the LLM subsystem
+    llm = sys.modules.get(f"{__package__}.llm")
+    if llm is None:
+        return {"loaded": False}
+    return {"loaded": True, "limiter": llm.LLM_LIMITER.stats(), "single_flight": llm.LLM_SINGLE_FLIGHT.stats()}
@@ -1,29 +1,41 @@
+import asyncio
 import os
-from fastapi import FastAPI, Depends, Request
+import sys
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from typing import Optional
+from fastapi.responses import JSONResponse, PlainTextResponse
 from dotenv import load_dotenv
 
-from .database import Base, engine, get_db
-from .models import InputText, User
-from .oauth import router as oauth_router
-from .auth import get_current_user
-from .warband_lore import generate_warband_lore
-# Import your Trench Crusade math functions here:
-from .trench_crusade_math import (
-    compute,
-    compute_success_distribution,
-    compute_injury_outcome_refined,
-    plot_distributions_with_out_of_action_fixed,
-    injury_thresholds
-)
+from .concurrency import Saturated
+from .dice import DiceExpressionError
+from .logging_config import configure_logging
+from .math_routes import router as math_router
+from .matchup import shutdown_process_pool
+from .metrics import MetricsMiddleware, render_metrics
+from .render import router as render_router, shutdown_render_pool, RENDER_CACHE
+from .trench_crusade_math import prewarm_distribution_cache, DISTRIBUTION_CACHE
 
 load_dotenv()
-
-Base.metadata.create_all(bind=engine)
+configure_logging()
+
+# "full" serves everything; "math" mounts only the math routes, for lightweight compute workers
+# that need neither the database nor the lore subsystem
+APP_MODE = os.getenv("APP_MODE", "full")
+if APP_MODE not in ("full", "math"):
+    raise ValueError(f"Unknown APP_MODE {APP_MODE!r}, expected 'full' or 'math'")
+FULL_APP = APP_MODE == "full"
+
+if FULL_APP:
+    from .database import Base, engine, async_engine
+    from .auth import USER_CACHE
+    from .roster import ROSTER_CACHE
+    from .oauth import router as oauth_router
+    from .user_routes import router as user_router
+    from .lore_routes import router as lore_router
+    from .lore_jobs import router as lore_jobs_router, start_lore_job_workers, stop_lore_job_workers
+
+    Base.metadata.create_all(bind=engine)
 
 app = FastAPI()
 
@@ -40,101 +52,85 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-# Include OAuth router
-app.include_router(oauth_router)
-
-
-class TextInput(BaseModel):
-    text: str
-
-@app.post("/submit")
-def submit_text(data: TextInput, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    # Requires login for now
-    new_entry = InputText(text=data.text, owner_id=current_user.id)
-    db.add(new_entry)
-    db.commit()
-    db.refresh(new_entry)
-    return {"message": "Text stored successfully", "id": new_entry.id}
-
-@app.get("/me")
-def get_me(current_user: User = Depends(get_current_user)):
-    return {"id": current_user.id, "username": current_user.username, "avatar_url": current_user.avatar_url}
-
-
-class ComputeRequest(BaseModel):
-    modified_dice: int = 0
-    extra_d6: bool = False
-    flat_modifier: int = 0
-
-class SuccessDistributionRequest(BaseModel):
-    modified_dice: int = 0
-    extra_d6: bool = False
-    flat_modifier: int = 0
-    threshold: int = 7
-    num_rolls: int = 1
-
-class InjuryOutcomeRequest(BaseModel):
-    hit_distribution: dict[int, float]
-    injury_params: dict[str, int | bool]
-
-@app.post("/compute_distribution")
-def get_compute_distribution(req: ComputeRequest):
-    dist = compute(req.modified_dice, req.extra_d6, req.flat_modifier)
-    return {"distribution": dist}
-
-@app.post("/compute_success_distribution")
-def get_success_distribution(req: SuccessDistributionRequest):
-    dist = compute_success_distribution(
-        modified_dice=req.modified_dice,
-        extra_d6=req.extra_d6,
-        flat_modifier=req.flat_modifier,
-        threshold=req.threshold,
-        num_rolls=req.num_rolls
-    )
-    return {"success_distribution": dist}
-
-@app.post("/compute_injury_outcome")
-def get_injury_outcome(req: InjuryOutcomeRequest):
-    injury_params = req.injury_params
-    # Ensure extra_d6 is bool
-    if isinstance(injury_params.get("extra_d6"), str):
-        injury_params["extra_d6"] = (injury_params["extra_d6"].lower() == "true")
-
-    result = compute_injury_outcome_refined(req.hit_distribution, injury_params, injury_thresholds)
-    blood_markers = []
-    blood_probs = []
-    for bm, p in result["blood_marker_distribution"].items():
-        blood_markers.append(bm)
-        blood_probs.append(p)
-
-    out_of_action_prob = result["out_of_action_probability"]
-    return {
-        "blood_marker_distribution": {
-            "markers": blood_markers,
-            "probabilities": blood_probs
-        },
-        "out_of_action_probability": out_of_action_prob
-    }
-
-@app.post("/warband_lore")
-def save_warband_lore(lore: dict):
-    print("Received Warband Lore:", lore)
-    return {"message": "saved warband"}
-
-
-class WarbandLoreRequest(BaseModel):
-    warband_text: str
-    theme_info: Optional[str] = None
-
-@app.post("/warband_lore/generate")
-def warband_lore_generate(req: WarbandLoreRequest):
-    print(f"Got request for warband lore... {req.warband_text}, {req.theme_info}")
-    lore = generate_warband_lore(req.warband_text, req.theme_info)
-    return lore
+app.add_middleware(MetricsMiddleware)
+
+app.include_router(math_router)
+app.include_router(render_router)
+if FULL_APP:
+    # Include OAuth router
+    app.include_router(oauth_router)
+    app.include_router(user_router)
+    app.include_router(lore_router)
+    app.include_router(lore_jobs_router)
+
+@app.exception_handler(Saturated)
+def saturated_handler(request: Request, exc: Saturated):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail}, headers={"Retry-After": str(exc.retry_after)})
+
+@app.exception_handler(DiceExpressionError)
+def dice_expression_handler(request: Request, exc: DiceExpressionError):
+    # Parameters that pass the request models can still make a roll no dice expression allows
+    return JSONResponse(status_code=422, content={"detail": str(exc)})
+
+PREWARM_DISTRIBUTION_CACHE = os.getenv("PREWARM_DISTRIBUTION_CACHE", "true").lower() == "true"
+# Compiling the lore graphs imports the whole LLM stack, so by default it happens on the first lore request
+PREWARM_LORE_GRAPHS = os.getenv("PREWARM_LORE_GRAPHS", "false").lower() == "true"
+# Build the lore index if it's missing and load it in the background, since requests never build it
+PREPARE_LORE_INDEX = os.getenv("PREPARE_LORE_INDEX", "true").lower() == "true"
+
+@app.on_event("startup")
+def prewarm_caches():
+    if PREWARM_DISTRIBUTION_CACHE:
+        prewarm_distribution_cache()
+    if FULL_APP and PREWARM_LORE_GRAPHS:
+        from .warband_lore import get_lore_graphs
+        get_lore_graphs()
+
+def prepare_lore_index():
+    from .llm import prepare_lore_index
+    prepare_lore_index()
+
+_background_tasks = set()
+
+@app.on_event("startup")
+async def start_background_workers():
+    if FULL_APP:
+        await start_lore_job_workers()
+    if FULL_APP and PREPARE_LORE_INDEX:
+        task = asyncio.create_task(asyncio.to_thread(prepare_lore_index))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+@app.on_event("shutdown")
+async def stop_workers():
+    if FULL_APP:
+        await stop_lore_job_workers()
+        await async_engine.dispose()
+    shutdown_process_pool()
+    shutdown_render_pool()
+
+
+@app.get("/cache_stats")
+def get_cache_stats():
+    stats = {"distribution_cache": DISTRIBUTION_CACHE.stats(), "render_cache": RENDER_CACHE.stats()}
+    if FULL_APP:
+        stats["user_cache"] = USER_CACHE.stats()
+        stats["roster_cache"] = ROSTER_CACHE.stats()
+    # The lore caches only exist once the lore subsystem has been loaded
+    warband_lore = sys.modules.get(f"{__package__}.warband_lore")
+    if warband_lore is not None:
+        stats["lore_cache"] = warband_lore.LORE_CACHE.stats()
+        stats["retrieval_cache"] = warband_lore.RETRIEVAL_CACHE.stats()
+    return stats
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok"}
+    return {"status": "ok", "mode": APP_MODE}
 
-app.mount("/", StaticFiles(directory="frontend/dist", html=True), name="static")
+# Serve the built frontend when it's there; API-only deployments don't ship it
+if FULL_APP and os.path.isdir("frontend/dist"):
+    app.mount("/", StaticFiles(directory="frontend/dist", html=True), name="static")
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+from .cache import LRUCache
+from .simulation import CHUNK_SIZE, injury_modifier, is_exact_expressible, simulate_attacks
+from .trench_crusade_math import compute_success_distribution, compute_injury_outcome_refined
+
+MATCHUP_WORKERS = int(os.getenv("MATCHUP_WORKERS", os.cpu_count() or 1))
+# Finished and running jobs are kept for polling until this many newer jobs push them out
+MATCHUP_JOBS = LRUCache(maxsize=int(os.getenv("MATCHUP_JOB_HISTORY", "256")))
+
+_process_pool = None
+_running_jobs = set()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=MATCHUP_WORKERS)
+    return _process_pool
+
+
+def _discard_broken_pool(pool: ProcessPoolExecutor):
+    # A worker died (e.g. killed for memory), which breaks the whole pool; the next job starts a new one
+    global _process_pool
+    if _process_pool is pool:
+        _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def _run_shard(shard: dict) -> dict:
+    """
+    Resolve the attacks against one defender, exactly or as one simulation shard.
+
+    Runs in a worker process, so it only takes and returns plain data.
+
+    Returns:
+        dict: Partial histogram as the blood marker distribution and Out of Action probability,
+              with the number of simulations it represents as its weight (1 for exact results).
+    """
+    attacks, defender, thresholds = shard["attacks"], shard["defender"], shard["thresholds"]
+    if shard["method"] == "exact":
+        attack = attacks[0]
+        injury_params = dict(attack["injury_params"], flat_modifier=injury_modifier(attack, defender))
+        hit_distribution = compute_success_distribution(
+            modified_dice=attack["modified_dice"],
+            num_rolls=attack["num_rolls"],
+            extra_d6=attack["extra_d6"],
+            flat_modifier=attack["flat_modifier"],
+            threshold=attack["threshold"]
+        )
+        result = compute_injury_outcome_refined(hit_distribution, injury_params, thresholds)
+        weight = 1
+    else:
+        result = simulate_attacks(attacks, thresholds, defender, num_simulations=shard["num_simulations"], seed=shard["seed"])
+        weight = shard["num_simulations"]
+
+    return {
+        "defender": shard["defender_index"],
+        "weight": weight,
+        "blood_marker_distribution": dict(result["blood_marker_distribution"]),
+        "out_of_action_probability": result["out_of_action_probability"],
+    }
+
+
+def plan_matchup(attackers: list, defenders: list, targets: list, thresholds: dict,
+                 num_simulations: int = 100_000, seed: int = None) -> list:
+    """
+    Split a warband matchup into independent shards, one list entry per unit of work.
+
+    Attackers sharing a target are resolved against it in sequence. A defender facing a single
+    attack profile the exact engine covers becomes one exact shard; any other defender is
+    simulated in shards of at most CHUNK_SIZE sequences.
+
+    Args:
+        attackers (list): Attacking units as dicts with a list of attack profiles under "attacks".
+        defenders (list): Defending units as dicts with optional "armour".
+        targets (list): The index of the defender each attacker targets, round robin if None.
+        thresholds (dict): Thresholds for injury outcomes.
+        num_simulations (int): Simulations per defender that cannot be resolved exactly.
+        seed (int): Seed for the simulated shards.
+
+    Returns:
+        list: Shard descriptions for `_run_shard`.
+    """
+    if not defenders:
+        raise ValueError("A matchup needs at least one defender.")
+    if targets is None:
+        targets = [i % len(defenders) for i in range(len(attackers))]
+    if len(targets) != len(attackers) or any(not 0 <= t < len(defenders) for t in targets):
+        raise ValueError("Every attacker needs the index of a defender to target.")
+
+    num_shards = max(1, min(MATCHUP_WORKERS, -(-num_simulations // CHUNK_SIZE)))
+    shard_seeds = iter(np.random.SeedSequence(seed).generate_state(len(defenders) * num_shards).tolist())
+
+    shards = []
+    for defender_index, defender in enumerate(defenders):
+        attacks = [attack for attacker, target in zip(attackers, targets) if target == defender_index
+                   for attack in attacker["attacks"]]
+        if not attacks:
+            continue
+        shard = {"defender_index": defender_index, "attacks": attacks, "defender": defender, "thresholds": thresholds}
+
+        # Armour only shifts the injury roll, so it doesn't rule out the exact engine
+        if is_exact_expressible(attacks, {}):
+            shards.append(dict(shard, method="exact"))
+            continue
+        for i in range(num_shards):
+            size = num_simulations // num_shards + (i < num_simulations % num_shards)
+            shards.append(dict(shard, method="simulation", num_simulations=size, seed=next(shard_seeds)))
+
+    return shards
+
+
+def merge_shards(results: list, defenders: list) -> dict:
+    """
+    Merge partial histograms into per-defender outcomes and the distribution of Out of Action results.
+
+    Args:
+        results (list): Outputs of `_run_shard`.
+        defenders (list): The defending units.
+
+    Returns:
+        dict: Per-defender outcomes, the expected number of Out of Action results and its distribution.
+    """
+    merged = {}
+    for result in results:
+        entry = merged.setdefault(result["defender"], {"weight": 0, "markers": Counter(), "out_of_action": 0.0})
+        weight = result["weight"]
+        entry["weight"] += weight
+        entry["out_of_action"] += weight * result["out_of_action_probability"]
+        for markers, prob in result["blood_marker_distribution"].items():
+            entry["markers"][int(markers)] += weight * prob
+
+    outcomes = []
+    # Defenders are attacked independently, so their Out of Action counts convolve
+    out_of_action_distribution = np.ones(1)
+    for defender_index in sorted(merged):
+        entry = merged[defender_index]
+        out_of_action = entry["out_of_action"] / entry["weight"]
+        blood_marker_distribution = {m: p / entry["weight"] for m, p in sorted(entry["markers"].items())}
+        outcomes.append({
+            "defender": defender_index,
+            "name": defenders[defender_index].get("name", ""),
+            "out_of_action_probability": out_of_action,
+            "blood_marker_distribution": blood_marker_distribution,
+            "expected_blood_markers": sum(m * p for m, p in blood_marker_distribution.items()),
+        })
+        out_of_action_distribution = np.convolve(out_of_action_distribution, [1 - out_of_action, out_of_action])
+
+    return {
+        "defenders": outcomes,
+        "expected_out_of_action": float(sum(o["out_of_action_probability"] for o in outcomes)),
+        "out_of_action_distribution": out_of_action_distribution.tolist(),
+    }
+
+
+async def _run_job(job: dict, shards: list, defenders: list):
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    job["status"] = "running"
+    try:
+        futures = [loop.run_in_executor(pool, _run_shard, shard) for shard in shards]
+        results = []
+        for future in asyncio.as_completed(futures):
+            results.append(await future)
+            job["completed_shards"] += 1
+        job["result"] = merge_shards(results, defenders)
+        job["status"] = "done"
+    except BrokenProcessPool as e:
+        _discard_broken_pool(pool)
+        job["status"] = "error"
+        job["error"] = str(e)
+    except Exception as e:
+        job["status"] = "error"
+        job["error"] = str(e)
+
+
+def start_matchup_job(attackers: list, defenders: list, targets: list, thresholds: dict,
+                      num_simulations: int = 100_000, seed: int = None) -> dict:
+    """
+    Plan a matchup and start resolving its shards on the process pool.
+
+    Must be called from a running event loop; the job keeps running after the call returns.
+
+    Returns:
+        dict: The job record, updated in place as shards finish.
+    """
+    shards = plan_matchup(attackers, defenders, targets, thresholds, num_simulations, seed)
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "status": "pending",
+        "total_shards": len(shards),
+        "completed_shards": 0,
+        "result": None,
+        "error": None,
+    }
+    MATCHUP_JOBS.set(job["job_id"], job)
+
+    task = asyncio.get_running_loop().create_task(_run_job(job, shards, defenders))
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
+    return job
+
+
+def get_matchup_job(job_id: str):
+    return MATCHUP_JOBS.get(job_id)
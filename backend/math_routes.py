@@ -0,0 +1,303 @@
+import math
+import os
+from itertools import product
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field, ValidationError
+from typing import Annotated, Optional
+
+from .dice import DiceExpressionError
+from .simulation import simulate_attacks, is_exact_expressible, cross_check, expected_injury_rolls
+from .matchup import start_matchup_job, get_matchup_job
+from .trench_crusade_math import (
+    compute,
+    compute_success_distribution,
+    compute_injury_outcome_refined,
+    compute_batch,
+    compute_attack,
+    compute_expression,
+    compute_mixed_success_distribution,
+    injury_thresholds,
+    MAX_MODIFIED_DICE,
+    MAX_ROLL_OFFSET,
+    successes_from_distribution,
+)
+
+router = APIRouter()
+
+ModifiedDice = Annotated[int, Field(ge=-MAX_MODIFIED_DICE, le=MAX_MODIFIED_DICE)]
+RollOffset = Annotated[int, Field(ge=-MAX_ROLL_OFFSET, le=MAX_ROLL_OFFSET)]
+# Largest number of rolls the exact engine resolves per request
+MAX_BATCH_ROLLS = int(os.getenv("MAX_BATCH_ROLLS", "100"))
+
+
+class ComputeRequest(BaseModel):
+    modified_dice: ModifiedDice = 0
+    extra_d6: bool = False
+    flat_modifier: RollOffset = 0
+
+class SuccessDistributionRequest(BaseModel):
+    modified_dice: ModifiedDice = 0
+    extra_d6: bool = False
+    flat_modifier: RollOffset = 0
+    threshold: RollOffset = 7
+    num_rolls: int = 1
+
+class MixedSuccessRequest(BaseModel):
+    # One entry per kind of roll in the volley, num_rolls rolls each
+    profiles: list[SuccessDistributionRequest]
+
+class ExpressionRequest(BaseModel):
+    expression: str
+    # With a threshold, also the distribution of successes over num_rolls rolls
+    threshold: Optional[int] = None
+    num_rolls: int = 1
+
+class InjuryOutcomeRequest(BaseModel):
+    hit_distribution: dict[int, float]
+    injury_params: dict[str, int | bool]
+
+class AttackRequest(BaseModel):
+    hit_params: SuccessDistributionRequest = SuccessDistributionRequest()
+    injury_params: ComputeRequest = ComputeRequest()
+    include_hit_distribution: bool = True
+
+class SimulatedAttack(SuccessDistributionRequest):
+    num_rolls: int = Field(1, ge=0)
+    injury_params: ComputeRequest = ComputeRequest()
+    reroll_failed_hits: bool = False
+    armour_piercing: int = 0
+    bloodbath: int = 0
+
+class SimulationRequest(BaseModel):
+    attacks: list[SimulatedAttack]
+    armour: int = 0
+    num_simulations: int = 100_000
+    seed: Optional[int] = Field(None, ge=0)
+
+class MatchupAttack(SimulatedAttack):
+    # Attacks against a single target are resolved exactly, in memory quadratic in the rolls
+    num_rolls: int = Field(1, ge=0, le=MAX_BATCH_ROLLS)
+
+class MatchupUnit(BaseModel):
+    name: str = ""
+    attacks: list[MatchupAttack] = []
+    armour: int = 0
+
+class MatchupRequest(BaseModel):
+    attackers: list[MatchupUnit]
+    defenders: list[MatchupUnit]
+    # Index of the defender each attacker targets, round robin by default
+    targets: Optional[list[int]] = None
+    num_simulations: int = 100_000
+    seed: Optional[int] = Field(None, ge=0)
+
+# Budget of simulated attack rolls per request, so simulation latency stays bounded
+MAX_SIMULATED_ROLLS = int(os.getenv("MAX_SIMULATED_ROLLS", "20000000"))
+
+def _rolls_per_simulation(attacks: list, defender: dict) -> int:
+    """
+    Simulated dice per sequence, in units of a 2d6 roll: the simulator allocates every die, so a
+    roll with more dice, a re-rolled one, and the injury rolls of every possible hit, re-rolled
+    while they have no effect, use proportionally more of the budget.
+    """
+    rolls = 0.0
+    for attack in attacks:
+        hit_dice = (2 + abs(attack["modified_dice"]) + attack["extra_d6"]) * (2 if attack["reroll_failed_hits"] else 1)
+        injury = attack["injury_params"]
+        # Each injury attempt rolls both the standing and the downed target's roll
+        injury_dice = 4 + abs(injury["modified_dice"]) + abs(injury["modified_dice"] + 1) + 2 * injury["extra_d6"]
+        injury_rolls = expected_injury_rolls(attack, defender, injury_thresholds)
+        rolls += attack["num_rolls"] * (hit_dice + injury_dice * injury_rolls) / 2
+    return max(math.ceil(rolls), 1)
+
+class BatchParameters(BaseModel):
+    modified_dice: ModifiedDice = 0
+    extra_d6: bool = False
+    flat_modifier: RollOffset = 0
+    threshold: RollOffset = 7
+    num_rolls: int = 1
+    injury_modified_dice: ModifiedDice = 0
+    injury_extra_d6: bool = False
+    injury_flat_modifier: RollOffset = 0
+
+class BatchComputeRequest(BaseModel):
+    # Explicit parameter sets, and/or a grid whose cartesian product is appended to them
+    params: list[BatchParameters] = []
+    grid: dict[str, list[int | bool]] = {}
+
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10000"))
+MAX_MIXED_PROFILES = int(os.getenv("MAX_MIXED_PROFILES", "100"))
+MAX_MIXED_ROLLS = int(os.getenv("MAX_MIXED_ROLLS", "1000"))
+
+def _check_num_rolls(num_rolls: int):
+    # Hit distributions are dense over 0..num_rolls and cached, so their size must stay bounded
+    if not 0 <= num_rolls <= MAX_BATCH_ROLLS:
+        raise HTTPException(status_code=422, detail=f"num_rolls must be between 0 and {MAX_BATCH_ROLLS}")
+
+@router.post("/compute_distribution")
+def get_compute_distribution(req: ComputeRequest):
+    dist = compute(req.modified_dice, req.extra_d6, req.flat_modifier)
+    return {"distribution": dist}
+
+@router.post("/compute_success_distribution")
+def get_success_distribution(req: SuccessDistributionRequest):
+    _check_num_rolls(req.num_rolls)
+    dist = compute_success_distribution(
+        modified_dice=req.modified_dice,
+        extra_d6=req.extra_d6,
+        flat_modifier=req.flat_modifier,
+        threshold=req.threshold,
+        num_rolls=req.num_rolls
+    )
+    return {"success_distribution": dist}
+
+@router.post("/compute_mixed_success_distribution")
+def get_mixed_success_distribution(req: MixedSuccessRequest):
+    if len(req.profiles) > MAX_MIXED_PROFILES:
+        raise HTTPException(status_code=422, detail=f"Volleys are limited to {MAX_MIXED_PROFILES} profiles")
+    if any(profile.num_rolls < 0 for profile in req.profiles) or sum(profile.num_rolls for profile in req.profiles) > MAX_MIXED_ROLLS:
+        raise HTTPException(status_code=422, detail=f"num_rolls must be non-negative and total at most {MAX_MIXED_ROLLS}")
+
+    result = compute_mixed_success_distribution([profile.model_dump() for profile in req.profiles])
+    return {
+        "pmf": result["pmf"].tolist(),
+        "cdf": result["cdf"].tolist(),
+        "success_probability": result["success_probability"].tolist(),
+        "expected_successes": result["expected_successes"],
+    }
+
+@router.post("/compute_expression")
+def get_expression_distribution(req: ExpressionRequest):
+    _check_num_rolls(req.num_rolls)
+    try:
+        dist = compute_expression(req.expression)
+    except DiceExpressionError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    response = {"distribution": dist}
+    if req.threshold is not None:
+        response["success_distribution"] = successes_from_distribution(dist, req.num_rolls, req.threshold)
+    return response
+
+@router.post("/compute_injury_outcome")
+def get_injury_outcome(req: InjuryOutcomeRequest):
+    injury_params = req.injury_params
+    # Ensure extra_d6 is bool
+    if isinstance(injury_params.get("extra_d6"), str):
+        injury_params["extra_d6"] = (injury_params["extra_d6"].lower() == "true")
+
+    if max(req.hit_distribution, default=0) > MAX_BATCH_ROLLS:
+        raise HTTPException(status_code=422, detail=f"Hit counts are limited to {MAX_BATCH_ROLLS}")
+    try:
+        result = compute_injury_outcome_refined(req.hit_distribution, injury_params, injury_thresholds)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    blood_markers = []
+    blood_probs = []
+    for bm, p in result["blood_marker_distribution"].items():
+        blood_markers.append(bm)
+        blood_probs.append(p)
+
+    out_of_action_prob = result["out_of_action_probability"]
+    return {
+        "blood_marker_distribution": {
+            "markers": blood_markers,
+            "probabilities": blood_probs
+        },
+        "out_of_action_probability": out_of_action_prob
+    }
+
+@router.post("/compute_attack")
+def get_attack_outcome(req: AttackRequest):
+    _check_num_rolls(req.hit_params.num_rolls)
+    result = compute_attack(req.hit_params.model_dump(), req.injury_params.model_dump(), injury_thresholds)
+    blood_marker_distribution = result["blood_marker_distribution"]
+    response = {
+        "blood_marker_distribution": {
+            "markers": list(blood_marker_distribution.keys()),
+            "probabilities": list(blood_marker_distribution.values())
+        },
+        "out_of_action_probability": result["out_of_action_probability"]
+    }
+    if req.include_hit_distribution:
+        response["success_distribution"] = result["success_distribution"]
+    return response
+
+@router.post("/simulate")
+def get_simulation(req: SimulationRequest):
+    attacks = [attack.model_dump() for attack in req.attacks]
+    defender = {"armour": req.armour}
+    rolls_per_simulation = _rolls_per_simulation(attacks, defender)
+    num_simulations = min(req.num_simulations, MAX_SIMULATED_ROLLS // rolls_per_simulation)
+    if not attacks or num_simulations <= 0:
+        raise HTTPException(status_code=422, detail="Simulation needs at least one attack and a positive simulation count")
+
+    result = simulate_attacks(attacks, injury_thresholds, defender, num_simulations=num_simulations, seed=req.seed)
+    # The exact engine's cost grows with the cube of the hit count, so large attacks go unchecked
+    if is_exact_expressible(attacks, defender) and attacks[0]["num_rolls"] <= MAX_BATCH_ROLLS:
+        result["cross_check"] = cross_check(attacks, injury_thresholds, result, defender)
+    return result
+
+@router.post("/matchup", status_code=202)
+async def start_matchup(req: MatchupRequest):
+    attackers = [{"name": unit.name, "attacks": [attack.model_dump() for attack in unit.attacks]} for unit in req.attackers]
+    defenders = [{"name": unit.name, "armour": unit.armour} for unit in req.defenders]
+    # Armour makes injury rolls fail more often, so budget against the most armoured defender
+    armour = max((defender["armour"] for defender in defenders), default=0)
+    rolls_per_simulation = _rolls_per_simulation([attack for unit in attackers for attack in unit["attacks"]], {"armour": armour})
+    num_simulations = min(req.num_simulations, MAX_SIMULATED_ROLLS // rolls_per_simulation)
+    if num_simulations <= 0:
+        raise HTTPException(status_code=422, detail="Matchup exceeds the simulation budget")
+
+    try:
+        job = start_matchup_job(attackers, defenders, req.targets, injury_thresholds, num_simulations, req.seed)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"job_id": job["job_id"], "status": job["status"], "total_shards": job["total_shards"]}
+
+@router.get("/matchup/{job_id}")
+def get_matchup(job_id: str):
+    job = get_matchup_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown matchup job")
+    return job
+
+@router.post("/compute/batch")
+def get_batch(req: BatchComputeRequest):
+    fields = list(BatchParameters.model_fields)
+    unknown = set(req.grid) - set(fields)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown grid parameters: {sorted(unknown)}")
+
+    # Grid values are checked like explicit parameter sets, strictly so that booleans and counts don't mix
+    for field, values in req.grid.items():
+        for value in values:
+            try:
+                BatchParameters.model_validate({field: value}, strict=True)
+            except ValidationError as e:
+                raise HTTPException(status_code=422, detail=f"Invalid grid value {value!r} for {field}: {e.errors()[0]['msg']}")
+
+    grid_size = 1
+    for values in req.grid.values():
+        grid_size *= len(values)
+    if len(req.params) + (grid_size if req.grid else 0) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=422, detail=f"Batch is limited to {MAX_BATCH_SIZE} parameter sets")
+
+    columns = {field: [getattr(p, field) for p in req.params] for field in fields}
+    if req.grid:
+        defaults = BatchParameters()
+        axes = [req.grid.get(field, [getattr(defaults, field)]) for field in fields]
+        for combination in product(*axes):
+            for field, value in zip(fields, combination):
+                columns[field].append(value)
+
+    if not columns["num_rolls"]:
+        raise HTTPException(status_code=422, detail="No parameter sets given")
+    if min(columns["num_rolls"]) < 0 or max(columns["num_rolls"]) > MAX_BATCH_ROLLS:
+        raise HTTPException(status_code=422, detail=f"num_rolls must be between 0 and {MAX_BATCH_ROLLS}")
+
+    result = compute_batch(**columns, thresholds=injury_thresholds)
+    return {
+        "params": columns,
+        **{name: values.tolist() for name, values in result.items()}
+    }
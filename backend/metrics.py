@@ -0,0 +1,325 @@
+"""
+In-process metrics in the Prometheus text format, plus request timing and profiling middleware.
+
+Metrics are plain counters and histograms kept in this process; `/metrics` renders them
+together with the registered caches and collectors. With METRICS_ENABLED=false, `timed`
+leaves functions undecorated and `span` does nothing, so instrumentation costs nothing.
+"""
+import functools
+import inspect
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Sampling profiler for slow requests: off by default
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", "1.0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    # Label values are quoted strings in the text format; route paths and cache names may contain anything
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # Per label set: [count per bucket (+Inf last), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+_metrics = []
+_caches = {}
+_collectors = []
+
+
+def counter(name: str, documentation: str, labels: tuple = ()) -> Counter:
+    metric = Counter(name, documentation, labels)
+    _metrics.append(metric)
+    return metric
+
+
+def histogram(name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    metric = Histogram(name, documentation, labels, buckets)
+    _metrics.append(metric)
+    return metric
+
+
+def register_cache(name: str, cache):
+    """
+    Report an LRUCache's counters on /metrics under the given cache label.
+    """
+    _caches[name] = cache
+
+
+def register_collector(collect):
+    """
+    Add a callable returning {metric_name: (type, documentation, {label_tuple_or_(): value})},
+    evaluated on every scrape; for state that lives elsewhere, like pool and limiter gauges.
+    """
+    _collectors.append(collect)
+
+
+HTTP_REQUEST_SECONDS = histogram(
+    "trenchmath_http_request_duration_seconds", "Request latency by route.", ("method", "route", "status")
+)
+FUNCTION_SECONDS = histogram(
+    "trenchmath_function_duration_seconds", "Latency of instrumented functions, cache hits included.", ("function",)
+)
+
+
+@contextmanager
+def span(name: str, metric: Histogram = FUNCTION_SECONDS):
+    """
+    Time the enclosed block into `metric` under the label `name`.
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric.observe(time.perf_counter() - start, name)
+
+
+def timed(name: str = None, metric: Histogram = FUNCTION_SECONDS):
+    """
+    Decorator timing every call of a sync or async function into `metric`.
+    """
+    def decorator(fn):
+        if not METRICS_ENABLED:
+            return fn
+        label = name or fn.__name__
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    metric.observe(time.perf_counter() - start, label)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - start, label)
+
+        # Keep the cache bypass of @cached functions reachable
+        if hasattr(fn, "uncached"):
+            wrapper.uncached = fn.uncached
+        return wrapper
+
+    return decorator
+
+
+def _render_caches() -> list:
+    if not _caches:
+        return []
+    series = {
+        "hits": ("counter", "Cache lookups that found an entry."),
+        "misses": ("counter", "Cache lookups that found nothing."),
+        "evictions": ("counter", "Entries evicted to stay within the size bound."),
+        "expirations": ("counter", "Entries dropped after their TTL."),
+        "size": ("gauge", "Entries currently cached."),
+        "hit_rate": ("gauge", "Hits over lookups since start."),
+    }
+    stats = {name: cache.stats() for name, cache in _caches.items()}
+    lines = []
+    for key, (kind, documentation) in series.items():
+        name = f"trenchmath_cache_{key}" + ("_total" if kind == "counter" else "")
+        lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+        lines += [f'{name}{{cache="{_escape(cache)}"}} {values[key]}' for cache, values in sorted(stats.items())]
+    return lines
+
+
+def _render_collectors() -> list:
+    lines = []
+    for collect in _collectors:
+        try:
+            collected = collect()
+        except Exception:
+            logger.exception("Metrics collector failed")
+            continue
+        for name, (kind, documentation, samples) in collected.items():
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+            for labels, value in samples.items():
+                label_text = "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}" if labels else ""
+                lines.append(f"{name}{label_text} {value}")
+    return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    lines += _render_caches()
+    lines += _render_collectors()
+    return "\n".join(lines) + "\n"
+
+
+# Held while a request is profiled. cProfile sees every request running concurrently in the
+# process, and a second profiler would take over from the first, so profiles don't overlap
+_profile_lock = threading.Lock()
+
+
+def _start_profiler():
+    # pyinstrument samples the stack and follows async tasks; cProfile is the stdlib fallback
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        from pyinstrument import Profiler
+        profiler = Profiler(async_mode="enabled")
+    except ImportError:
+        import cProfile
+        profiler = cProfile.Profile()
+    try:
+        profiler.start() if hasattr(profiler, "start") else profiler.enable()
+    except Exception:
+        _profile_lock.release()
+        raise
+    return profiler
+
+
+def _save_profile(profiler, method: str, path: str, seconds: float):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{method}-{path.strip('/').replace('/', '_') or 'root'}")
+    if hasattr(profiler, "output_html"):
+        profiler.stop()
+        filename = stem + ".html"
+        with open(filename, "w") as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        filename = stem + ".prof"
+        profiler.dump_stats(filename)
+    logger.warning("Slow request profiled", extra={"method": method, "path": path, "seconds": seconds, "profile": filename})
+
+
+def _stop_profiler(profiler):
+    if hasattr(profiler, "output_html"):
+        profiler.stop()
+    else:
+        profiler.disable()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency per route template, and profiling a sample of
+    requests when PROFILE_REQUESTS is set; profiles of requests slower than PROFILE_SLOW_SECONDS
+    are written to PROFILE_DIR. Sending `X-Profile: 1` forces profiling of that request, unless
+    another request is being profiled: only one profile runs at a time. A cProfile profile still
+    includes whatever else the process ran meanwhile, so it is approximate under concurrency.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route(self, scope) -> str:
+        # Label by route template, never the raw path, to keep the series count bounded
+        if self._routes is None:
+            router = scope["app"].router
+            self._routes = {route.endpoint: route.path for route in router.routes if hasattr(route, "endpoint")}
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        profiler = None
+        if PROFILE_REQUESTS and (random.random() < PROFILE_SAMPLE_RATE or (b"x-profile", b"1") in scope["headers"]):
+            profiler = _start_profiler()
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            seconds = time.perf_counter() - start
+            HTTP_REQUEST_SECONDS.observe(seconds, scope["method"], self._route(scope), status["code"])
+            if profiler is not None:
+                try:
+                    if seconds >= PROFILE_SLOW_SECONDS:
+                        _save_profile(profiler, scope["method"], scope["path"], seconds)
+                    else:
+                        _stop_profiler(profiler)
+                finally:
+                    _profile_lock.release()
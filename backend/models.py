@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, JSON, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -15,7 +16,36 @@ class User(Base):
 class InputText(Base):
     __tablename__ = "input_texts"
     id = Column(Integer, primary_key=True, index=True)
-    text = Column(String, index=True)
+    text = Column(String)
+    # sha256 of the text; a user storing the same text twice keeps one row
+    content_hash = Column(String(64), nullable=False)
     owner_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="texts")
 
+    __table_args__ = (
+        Index("ix_input_texts_owner_id_content_hash", "owner_id", "content_hash", unique=True),
+    )
+
+class LoreJob(Base):
+    __tablename__ = "lore_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    theme_info = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    owner_id = Column(Integer, ForeignKey("users.id"))
+    items = relationship("LoreJobItem", back_populates="job", order_by="LoreJobItem.position")
+
+class LoreJobItem(Base):
+    __tablename__ = "lore_job_items"
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("lore_jobs.id"), index=True)
+    position = Column(Integer)
+    warband_text = Column(String)
+    # pending, running, done or error
+    status = Column(String, default="pending", index=True)
+    result = Column(JSON, nullable=True)
+    error = Column(String, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    # Lease of the worker running the item; running items whose lease expired are claimed again
+    claimed_at = Column(DateTime, nullable=True)
+    claimed_by = Column(String, nullable=True)
+    job = relationship("LoreJob", back_populates="items")
@@ -1,17 +1,19 @@
+import logging
 import os
 import httpx
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from .database import get_db
 from .models import User
 from .utils import create_jwt
+from .auth import invalidate_user
 from dotenv import load_dotenv
 
 load_dotenv()
 
-print("CWD:", os.getcwd())
-print("DISCORD_REDIRECT_URI after load:", os.getenv("DISCORD_REDIRECT_URI"))
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -23,7 +25,7 @@ DISCORD_OAUTH_TOKEN_URL = "https://discord.com/api/oauth2/token"
 DISCORD_API_USER_URL = "https://discord.com/api/users/@me"
 FRONTEND_ORIGIN = os.getenv("FRONTEND_ORIGIN")
 
-print("DISCORD_REDIRECT_URI:", DISCORD_REDIRECT_URI)
+logger.debug("Discord OAuth configured", extra={"cwd": os.getcwd(), "redirect_uri": DISCORD_REDIRECT_URI})
 
 @router.get("/auth/discord/login")
 def discord_login():
@@ -37,7 +39,7 @@ def discord_login():
     return RedirectResponse(url)
 
 @router.get("/auth/discord/callback")
-async def discord_callback(code: str, db: Session = Depends(get_db)):
+async def discord_callback(code: str, db: AsyncSession = Depends(get_db)):
     # Exchange code for token
     data = {
         "client_id": DISCORD_CLIENT_ID,
@@ -66,20 +68,23 @@ async def discord_callback(code: str, db: Session = Depends(get_db)):
     username = user_data["username"] + "#" + user_data["discriminator"]
     avatar_url = f"https://cdn.discordapp.com/avatars/{discord_id}/{user_data['avatar']}.png" if user_data.get("avatar") else None
 
-    user = db.query(User).filter(User.discord_id == discord_id).first()
+    user = await db.scalar(select(User).where(User.discord_id == discord_id))
     if not user:
         user = User(discord_id=discord_id, username=username, avatar_url=avatar_url)
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
     else:
         # Update info if needed
         user.username = username
         user.avatar_url = avatar_url
-        db.commit()
+        await db.commit()
 
-    # Create JWT
-    token = create_jwt({"sub": str(user.id)})
+    # Drop the cached profile so the next request sees the update
+    invalidate_user(user.id)
+
+    # Create JWT; the profile claims let read-only routes skip the user lookup
+    token = create_jwt({"sub": str(user.id), "username": user.username, "avatar_url": user.avatar_url})
 
     # Redirect back to frontend with a session cookie
     response = RedirectResponse(FRONTEND_ORIGIN)
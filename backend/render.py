@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Literal
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+
+from .cache import LRUCache
+from .concurrency import SingleFlight
+from .metrics import register_cache
+from .trench_crusade_math import MAX_MODIFIED_DICE, MAX_ROLL_OFFSET, compute_attack, draw_distributions_with_out_of_action, injury_thresholds
+
+router = APIRouter()
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+# Rendered images by parameter hash; a PNG chart is a few tens of kB
+RENDER_CACHE = LRUCache(maxsize=int(os.getenv("RENDER_CACHE_SIZE", "512")))
+register_cache("render", RENDER_CACHE)
+MAX_CHART_ROLLS = int(os.getenv("MAX_CHART_ROLLS", "30"))
+
+MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+_render_pool = None
+_render_single_flight = SingleFlight()
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+    return _render_pool
+
+
+def shutdown_render_pool():
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+
+
+def render_attack_chart(hit_distribution: dict, injury_outcome: dict, image_format: str = "png") -> bytes:
+    """
+    Render the hit and injury charts of an attack off-screen, without pyplot's global state.
+
+    Runs in a worker process; matplotlib is only imported there.
+
+    Returns:
+        bytes: The encoded image.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=(12, 5))
+    FigureCanvasAgg(figure)
+    draw_distributions_with_out_of_action(figure, hit_distribution, injury_outcome)
+    buffer = io.BytesIO()
+    # SVG output switches to the SVG canvas for this one save
+    figure.savefig(buffer, format=image_format, dpi=100)
+    return buffer.getvalue()
+
+
+def chart_etag(params: dict) -> str:
+    key = json.dumps({"params": params, "thresholds": injury_thresholds}, sort_keys=True)
+    return '"' + hashlib.sha256(key.encode("utf-8")).hexdigest() + '"'
+
+
+async def _render(params: dict) -> bytes:
+    hit_params = {name: params[name] for name in ("modified_dice", "extra_d6", "flat_modifier", "threshold", "num_rolls")}
+    injury_params = {
+        "modified_dice": params["injury_modified_dice"],
+        "extra_d6": params["injury_extra_d6"],
+        "flat_modifier": params["injury_flat_modifier"],
+    }
+    result = compute_attack(hit_params, injury_params, injury_thresholds)
+    injury_outcome = {
+        "blood_marker_distribution": result["blood_marker_distribution"],
+        "out_of_action_probability": result["out_of_action_probability"],
+    }
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_render_pool(), render_attack_chart, result["success_distribution"], injury_outcome, params["format"]
+    )
+
+
+@router.get("/render/attack_chart")
+async def get_attack_chart(
+    request: Request,
+    modified_dice: int = Query(0, ge=-MAX_MODIFIED_DICE, le=MAX_MODIFIED_DICE),
+    extra_d6: bool = False,
+    flat_modifier: int = Query(0, ge=-MAX_ROLL_OFFSET, le=MAX_ROLL_OFFSET),
+    threshold: int = Query(7, ge=-MAX_ROLL_OFFSET, le=MAX_ROLL_OFFSET),
+    num_rolls: int = 1,
+    injury_modified_dice: int = Query(0, ge=-MAX_MODIFIED_DICE, le=MAX_MODIFIED_DICE),
+    injury_extra_d6: bool = False,
+    injury_flat_modifier: int = Query(0, ge=-MAX_ROLL_OFFSET, le=MAX_ROLL_OFFSET),
+    image_format: Literal["png", "svg"] = Query("png", alias="format"),
+):
+    if not 0 <= num_rolls <= MAX_CHART_ROLLS:
+        raise HTTPException(status_code=422, detail=f"num_rolls must be between 0 and {MAX_CHART_ROLLS}")
+
+    params = {
+        "modified_dice": modified_dice, "extra_d6": extra_d6, "flat_modifier": flat_modifier,
+        "threshold": threshold, "num_rolls": num_rolls, "injury_modified_dice": injury_modified_dice,
+        "injury_extra_d6": injury_extra_d6, "injury_flat_modifier": injury_flat_modifier, "format": image_format,
+    }
+    etag = chart_etag(params)
+    # Charts are a pure function of the parameters and the injury thresholds, which can change at
+    # runtime; caches keep them but revalidate, and the ETag (covering both) makes that a cheap 304
+    headers = {"ETag": etag, "Cache-Control": "public, no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    image = RENDER_CACHE.get(etag)
+    if image is None:
+        image = await _render_single_flight.do(etag, lambda: _render(params))
+        RENDER_CACHE.set(etag, image)
+    return Response(content=image, media_type=MEDIA_TYPES[image_format], headers=headers)
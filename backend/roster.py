@@ -0,0 +1,256 @@
+import hashlib
+import os
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+from .cache import LRUCache
+from .metrics import register_cache
+
+# Parsed rosters keyed on the sha256 of their text
+ROSTER_CACHE = LRUCache(maxsize=int(os.getenv("ROSTER_CACHE_SIZE", "1024")))
+register_cache("roster", ROSTER_CACHE)
+
+SECTION_RE = re.compile(r"^\[\s*(?P<section>[^\]]+?)\s*\](?P<rest>.*)$")
+UNIT_RE = re.compile(
+    r"^(?P<name>[^|]+?)\s*\|\s*(?P<unit_type>[^|]+?)\s*\|\s*(?P<ducats>-?\d+)\s*ducats\s*(?P<glory>-?\d+)\s*glory"
+)
+ITEM_RE = re.compile(r"^-\s*(?P<name>.+?)\s*(?:\((?P<cost>-?\d+)\s*(?P<currency>ducats|glory)\))?\s*$")
+TREASURY_RE = re.compile(
+    r"Total\s*:\s*(?P<total>-?\d+)\s*\|\s*Spent\s*:\s*(?P<spent>-?\d+)\s*(?:\((?P<lost>-?\d+)\s*Lost\))?"
+    r"\s*\|\s*Available\s*:\s*(?P<available>-?\d+)"
+)
+
+# Costs are stored as signed 64-bit integers
+MAX_COST = 2 ** 63 - 1
+
+# Sections listing a unit's items rather than warband members
+ITEM_SECTIONS = {"EQUIPMENT", "UPGRADES"}
+TREASURY_SECTIONS = {"DUCATS", "GLORY"}
+
+
+class RosterError(ValueError):
+    pass
+
+
+def _cost(text: str) -> int:
+    value = int(text)
+    if abs(value) > MAX_COST:
+        raise RosterError(f"Cost {value} is out of range")
+    return value
+
+
+class Item:
+    __slots__ = ("name", "ducats", "glory")
+
+    def __init__(self, name: str, ducats: int = 0, glory: int = 0):
+        self.name = name
+        self.ducats = ducats
+        self.glory = glory
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "ducats": self.ducats, "glory": self.glory}
+
+
+class Unit:
+    __slots__ = ("name", "unit_type", "section", "ducats", "glory", "equipment", "upgrades")
+
+    def __init__(self, name: str, unit_type: str, section: str, ducats: int = 0, glory: int = 0):
+        self.name = name
+        self.unit_type = unit_type
+        self.section = section
+        self.ducats = ducats
+        self.glory = glory
+        self.equipment = []
+        self.upgrades = []
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "unit_type": self.unit_type,
+            "section": self.section,
+            "ducats": self.ducats,
+            "glory": self.glory,
+            "equipment": [item.to_dict() for item in self.equipment],
+            "upgrades": [item.to_dict() for item in self.upgrades],
+        }
+
+
+class Roster:
+    """
+    A parsed warband roster export.
+
+    Treasury lines are kept as array("q", [total, spent, lost, available]).
+    """
+    __slots__ = ("name", "faction", "ducats", "glory", "units", "modifiers", "content_hash")
+
+    def __init__(self, name: str = "", faction: str = "", content_hash: str = ""):
+        self.name = name
+        self.faction = faction
+        self.ducats = array("q", [0, 0, 0, 0])
+        self.glory = array("q", [0, 0, 0, 0])
+        self.units = []
+        self.modifiers = {}
+        self.content_hash = content_hash
+
+    def normalized_text(self) -> str:
+        """
+        Canonical text of the roster's content: units in a fixed order with sorted items,
+        without costs, treasury lines or formatting.
+        """
+        units = sorted(
+            " | ".join([unit.unit_type, unit.name] + sorted(item.name for item in unit.equipment + unit.upgrades))
+            for unit in self.units
+        )
+        return "\n".join([f"{self.name} | {self.faction}"] + units).casefold()
+
+    def unit_costs(self) -> array:
+        return array("q", (unit.ducats for unit in self.units))
+
+    def to_dict(self) -> dict:
+        treasury = ("total", "spent", "lost", "available")
+        return {
+            "name": self.name,
+            "faction": self.faction,
+            "ducats": dict(zip(treasury, self.ducats)),
+            "glory": dict(zip(treasury, self.glory)),
+            "units": [unit.to_dict() for unit in self.units],
+            "modifiers": self.modifiers,
+            "content_hash": self.content_hash,
+        }
+
+
+def parse_roster_lines(lines: Iterable[str], content_hash: str = "") -> Roster:
+    """
+    Parse a roster export line by line, so large inputs can be streamed from a file.
+
+    Args:
+        lines (Iterable[str]): Lines of the roster export.
+        content_hash (str): Hash of the roster text, recorded on the result.
+
+    Raises:
+        RosterError: If a cost doesn't fit in 64 bits.
+
+    Returns:
+        Roster: The parsed roster.
+    """
+    roster = Roster(content_hash=content_hash)
+    section = None
+    member_section = ""
+    unit = None
+
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("```"):
+            continue
+
+        match = SECTION_RE.match(line)
+        if match:
+            name = match.group("section").upper()
+            rest = match.group("rest")
+            if name in TREASURY_SECTIONS:
+                treasury = TREASURY_RE.search(rest)
+                if treasury:
+                    target = roster.ducats if name == "DUCATS" else roster.glory
+                    target[:] = array("q", (_cost(treasury.group(g) or "0") for g in ("total", "spent", "lost", "available")))
+                continue
+            section = name
+            if name not in ITEM_SECTIONS:
+                member_section = name
+                unit = None
+            continue
+
+        match = UNIT_RE.match(line)
+        if match:
+            unit = Unit(match.group("name"), match.group("unit_type"), member_section,
+                        _cost(match.group("ducats")), _cost(match.group("glory")))
+            roster.units.append(unit)
+            section = member_section
+            continue
+
+        match = ITEM_RE.match(line)
+        if match and unit is not None and section in ITEM_SECTIONS:
+            cost = _cost(match.group("cost") or "0")
+            glory = match.group("currency") == "glory"
+            item = Item(match.group("name"), ducats=0 if glory else cost, glory=cost if glory else 0)
+            (unit.equipment if section == "EQUIPMENT" else unit.upgrades).append(item)
+            continue
+
+        if section is None and not roster.units and "|" in line and not roster.name:
+            # Header line: warband name | faction
+            roster.name, _, roster.faction = (part.strip() for part in line.partition("|"))
+        elif section is not None:
+            roster.modifiers.setdefault(section, []).append(line)
+
+    return roster
+
+
+def roster_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def parse_roster(text: str) -> Roster:
+    """
+    Parse a roster export, reusing the cached result if the same text was parsed before.
+
+    Args:
+        text (str): The roster export text.
+
+    Raises:
+        RosterError: If a cost doesn't fit in 64 bits.
+
+    Returns:
+        Roster: The parsed roster. Cached rosters are shared, so don't modify the result.
+    """
+    content_hash = roster_hash(text)
+    roster = ROSTER_CACHE.get(content_hash)
+    if roster is None:
+        roster = parse_roster_lines(text.splitlines(), content_hash)
+        ROSTER_CACHE.set(content_hash, roster)
+    return roster
+
+
+def normalized_roster_key(text: str) -> str:
+    """
+    Key identifying a roster regardless of unit order, costs and whitespace. Text that isn't a
+    roster export is keyed on its whitespace-collapsed, case-folded form.
+    """
+    try:
+        roster = parse_roster(text)
+    except RosterError:
+        roster = None
+    normalized = roster.normalized_text() if roster and roster.units else " ".join(text.split()).casefold()
+    return roster_hash(normalized)
+
+
+def _parse_roster_file(path: str) -> tuple[str, Roster]:
+    with open(path, "rb") as f:
+        data = f.read()
+    return path, parse_roster_lines(data.decode("utf-8", errors="replace").splitlines(), hashlib.sha256(data).hexdigest())
+
+
+def parse_roster_directory(directory: str, suffix: str = ".txt", workers: Optional[int] = None,
+                           chunksize: int = 64) -> Iterator[tuple[str, Roster]]:
+    """
+    Parse every roster export in a directory.
+
+    Files are read and parsed in a process pool when `workers` is more than 1. Results are
+    yielded as they are produced and not added to the roster cache.
+
+    Args:
+        directory (str): Directory containing the roster exports.
+        suffix (str): Only files ending in this suffix are parsed.
+        workers (int): Number of worker processes, CPU count if None.
+        chunksize (int): Number of files handed to a worker at a time.
+
+    Yields:
+        tuple[str, Roster]: The file path and its parsed roster.
+    """
+    paths = (entry.path for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith(suffix))
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        yield from map(_parse_roster_file, paths)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_parse_roster_file, paths, chunksize=chunksize)
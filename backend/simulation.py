@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+import numpy as np
+
+from .trench_crusade_math import DIE_FACES, compute_attack, roll_pmf
+
+# Simulations are run in chunks of this many attack sequences to bound memory
+CHUNK_SIZE = 100_000
+# Injury rolls with no effect are re-rolled (as the exact engine conditions them away) at most this often
+MAX_INJURY_REROLLS = 50
+
+
+def _roll(rng: np.random.Generator, shape: tuple, modified_dice: int, extra_d6: bool, flat_modifier) -> np.ndarray:
+    """
+    Roll `shape` independent 2d6 rolls with the given advantage/disadvantage, extra die and modifier.
+    """
+    num_dice = 2 + abs(modified_dice)
+    dice = rng.integers(1, DIE_FACES + 1, size=shape + (num_dice,), dtype=np.int16)
+    if modified_dice > 0:  # Advantage: select top 2
+        dice.sort(axis=-1)
+        total = dice[..., -2:].sum(axis=-1)
+    elif modified_dice < 0:  # Disadvantage: select bottom 2
+        dice.sort(axis=-1)
+        total = dice[..., :2].sum(axis=-1)
+    else:
+        total = dice.sum(axis=-1)
+    if extra_d6:
+        total += rng.integers(1, DIE_FACES + 1, size=shape, dtype=np.int16)
+    return total + flat_modifier
+
+
+def injury_modifier(attack: dict, defender: dict) -> int:
+    # Armour lowers injury rolls; armour piercing cancels it out but never turns it into a bonus
+    armour = max(defender.get("armour", 0) - attack.get("armour_piercing", 0), 0)
+    return attack["injury_params"]["flat_modifier"] - armour
+
+
+def expected_injury_rolls(attack: dict, defender: dict, thresholds: dict) -> float:
+    """
+    Expected injury rolls per hit of `attack`, counting the re-rolls of rolls without effect
+    (at most MAX_INJURY_REROLLS), for whichever of a standing or downed target re-rolls more.
+    """
+    injury_params = attack["injury_params"]
+    no_effect = 0.0
+    for is_downed in (False, True):
+        pmf, offset = roll_pmf(injury_params["modified_dice"] + is_downed, injury_params["extra_d6"], injury_modifier(attack, defender))
+        rolls = np.arange(len(pmf)) + offset
+        effect = (rolls > thresholds["no_effect"]) & (
+            ((thresholds["blood_marker"][0] <= rolls) & (rolls <= thresholds["blood_marker"][1]))
+            | ((thresholds["downed"][0] <= rolls) & (rolls <= thresholds["downed"][1]))
+            | (rolls >= thresholds["out_of_action"])
+        )
+        no_effect = max(no_effect, float(pmf[~effect].sum()))
+    if no_effect >= 1:
+        return float(MAX_INJURY_REROLLS)
+    # Truncated geometric number of attempts
+    return (1 - no_effect ** MAX_INJURY_REROLLS) / (1 - no_effect)
+
+
+def _injury_outcomes(rng: np.random.Generator, is_downed: np.ndarray, injury_params: dict, flat_modifier: int,
+                     thresholds: dict) -> np.ndarray:
+    """
+    Resolve one injury roll per unit.
+
+    Returns:
+        np.ndarray: Per unit, 1 for one blood marker, 2 for two blood markers, 3 for Out of Action
+                    and 0 if no rolls had an effect within MAX_INJURY_REROLLS.
+    """
+    outcome = np.zeros(len(is_downed), dtype=np.int8)
+    pending = np.arange(len(is_downed))
+    for _ in range(MAX_INJURY_REROLLS):
+        if not len(pending):
+            break
+        downed = is_downed[pending]
+        # Downed units take an additional injury die
+        standing_roll = _roll(rng, (len(pending),), injury_params["modified_dice"], injury_params["extra_d6"], flat_modifier)
+        downed_roll = _roll(rng, (len(pending),), injury_params["modified_dice"] + 1, injury_params["extra_d6"], flat_modifier)
+        roll = np.where(downed, downed_roll, standing_roll)
+
+        effect = roll > thresholds["no_effect"]
+        blood = effect & (thresholds["blood_marker"][0] <= roll) & (roll <= thresholds["blood_marker"][1])
+        down = effect & ~blood & (thresholds["downed"][0] <= roll) & (roll <= thresholds["downed"][1])
+        out_of_action = effect & ~blood & ~down & (roll >= thresholds["out_of_action"])
+
+        result = np.zeros(len(pending), dtype=np.int8)
+        result[blood] = 1
+        result[down] = np.where(downed[down], 2, 1)
+        result[out_of_action] = 3
+        outcome[pending] = result
+        pending = pending[result == 0]
+
+    return outcome
+
+
+def _simulate_chunk(rng: np.random.Generator, size: int, attacks: list, defender: dict, thresholds: dict):
+    """
+    Simulate `size` attack sequences against a fresh defender.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Total hits, blood markers and Out of Action flag per sequence.
+    """
+    total_hits = np.zeros(size, dtype=np.int32)
+    markers = np.zeros(size, dtype=np.int32)
+    out_of_action = np.zeros(size, dtype=bool)
+
+    for attack in attacks:
+        num_rolls = attack["num_rolls"]
+        roll = _roll(rng, (size, num_rolls), attack["modified_dice"], attack["extra_d6"], attack["flat_modifier"])
+        success = roll >= attack["threshold"]
+        if attack.get("reroll_failed_hits"):
+            reroll = _roll(rng, (size, num_rolls), attack["modified_dice"], attack["extra_d6"], attack["flat_modifier"])
+            success |= reroll >= attack["threshold"]
+        hits = success.sum(axis=1)
+        total_hits += hits
+
+        injury_params = attack["injury_params"]
+        flat_modifier = injury_modifier(attack, defender)
+        bloodbath = attack.get("bloodbath", 0)
+        for hit in range(num_rolls):
+            active = np.flatnonzero((hits > hit) & ~out_of_action)
+            if not len(active):
+                break
+            outcome = _injury_outcomes(rng, markers[active] > 0, injury_params, flat_modifier, thresholds)
+            wounded = (outcome == 1) | (outcome == 2)
+            markers[active] += outcome * wounded + bloodbath * wounded
+            out_of_action[active] |= outcome == 3
+
+    return total_hits, markers, out_of_action
+
+
+def _wilson_interval(successes: np.ndarray, trials: int, z: float) -> tuple[np.ndarray, np.ndarray]:
+    p = successes / trials
+    denominator = 1 + z ** 2 / trials
+    center = (p + z ** 2 / (2 * trials)) / denominator
+    half_width = z * np.sqrt(p * (1 - p) / trials + z ** 2 / (4 * trials ** 2)) / denominator
+    return np.clip(center - half_width, 0, 1), np.clip(center + half_width, 0, 1)
+
+
+def simulate_attacks(attacks: list, thresholds: dict, defender: dict = None, num_simulations: int = 100_000,
+                     seed: int = None, z: float = 1.96, chunk_size: int = CHUNK_SIZE):
+    """
+    Monte Carlo simulation of one or more attack profiles resolved against a single defender.
+
+    Handles rules the exact engine cannot express: re-rolling failed hits, armour and armour
+    piercing, bloodbath (extra blood markers whenever an injury inflicts any) and several
+    attackers targeting the same unit in sequence.
+
+    Args:
+        attacks (list): Attack profiles as dicts with modified_dice, extra_d6, flat_modifier, threshold,
+                        num_rolls, injury_params, and optionally reroll_failed_hits, armour_piercing
+                        and bloodbath.
+        thresholds (dict): Thresholds for injury outcomes.
+        defender (dict): The target's properties, currently only armour.
+        num_simulations (int): The number of attack sequences to simulate.
+        seed (int): Seed for the random generator; results are reproducible for a given seed.
+                    A fresh seed is drawn if none is given and reported in the result.
+        z (float): Normal quantile of the reported confidence intervals (1.96 for 95%).
+        chunk_size (int): The number of sequences simulated per vectorized chunk.
+
+    Returns:
+        dict: Estimated hit, blood marker and Out of Action distributions with Wilson confidence
+              intervals, and convergence diagnostics over the chunks.
+    """
+    if num_simulations <= 0:
+        raise ValueError("Number of simulations must be positive.")
+    defender = defender or {}
+    num_chunks = -(-num_simulations // chunk_size)
+    # Each chunk gets an independent child stream so results don't depend on chunk scheduling
+    if seed is None:
+        # Keep drawn seeds small enough to survive a round trip through JSON numbers
+        seed = int(np.random.SeedSequence().entropy % 2 ** 53)
+    seed_sequence = np.random.SeedSequence(seed)
+    chunk_seeds = seed_sequence.spawn(num_chunks)
+
+    max_hits = sum(attack["num_rolls"] for attack in attacks)
+    hit_counts = np.zeros(max_hits + 1, dtype=np.int64)
+    marker_counts = Counter()
+    out_of_action_count = 0
+    chunk_estimates = []
+    running_estimates = []
+
+    remaining = num_simulations
+    for chunk_seed in chunk_seeds:
+        size = min(chunk_size, remaining)
+        remaining -= size
+        hits, markers, out_of_action = _simulate_chunk(np.random.default_rng(chunk_seed), size, attacks, defender, thresholds)
+
+        hit_counts += np.bincount(hits, minlength=max_hits + 1)
+        values, counts = np.unique(markers[~out_of_action], return_counts=True)
+        marker_counts.update(dict(zip(values.tolist(), counts.tolist())))
+        out_of_action_count += int(out_of_action.sum())
+
+        chunk_estimates.append(float(out_of_action.mean()))
+        running_estimates.append(out_of_action_count / (num_simulations - remaining))
+
+    markers = sorted(marker_counts)
+    marker_array = np.array([marker_counts[m] for m in markers])
+    marker_low, marker_high = _wilson_interval(marker_array, num_simulations, z)
+    hit_low, hit_high = _wilson_interval(hit_counts, num_simulations, z)
+    out_of_action_low, out_of_action_high = _wilson_interval(np.array(out_of_action_count), num_simulations, z)
+
+    # Spread of the per-chunk estimates; only meaningful with several chunks
+    chunk_estimates = np.array(chunk_estimates)
+    chunk_standard_error = float(chunk_estimates.std(ddof=1) / np.sqrt(len(chunk_estimates))) if len(chunk_estimates) > 1 else None
+
+    return {
+        "num_simulations": num_simulations,
+        "seed": seed,
+        "hit_distribution": {hits: float(count / num_simulations) for hits, count in enumerate(hit_counts)},
+        "blood_marker_distribution": Counter({m: float(c / num_simulations) for m, c in zip(markers, marker_array)}),
+        "out_of_action_probability": out_of_action_count / num_simulations,
+        "confidence_intervals": {
+            "hit_distribution": {hits: (float(lo), float(hi)) for hits, (lo, hi) in enumerate(zip(hit_low, hit_high))},
+            "blood_marker_distribution": {m: (float(lo), float(hi)) for m, lo, hi in zip(markers, marker_low, marker_high)},
+            "out_of_action_probability": (float(out_of_action_low), float(out_of_action_high)),
+        },
+        "convergence": {
+            "chunk_size": chunk_size,
+            "chunk_estimates": chunk_estimates.tolist(),
+            "running_estimates": running_estimates,
+            "chunk_standard_error": chunk_standard_error,
+        },
+    }
+
+
+def is_exact_expressible(attacks: list, defender: dict = None) -> bool:
+    """
+    Whether the closed-form engine covers these attacks: a single profile without simulation-only rules.
+    """
+    if len(attacks) != 1 or (defender or {}).get("armour", 0):
+        return False
+    attack = attacks[0]
+    return not (attack.get("reroll_failed_hits") or attack.get("bloodbath") or attack.get("armour_piercing"))
+
+
+def cross_check(attacks: list, thresholds: dict, simulation: dict, defender: dict = None, z: float = 1.96) -> dict:
+    """
+    Compare a simulation with the exact engine on a case the exact engine covers.
+
+    Args:
+        attacks (list): The simulated attack profiles.
+        thresholds (dict): Thresholds for injury outcomes.
+        simulation (dict): The result of `simulate_attacks` for these attacks.
+        defender (dict): The simulated defender.
+        z (float): Normal quantile the simulation's confidence intervals were computed with.
+
+    Returns:
+        dict: Exact probabilities, the largest absolute deviation of the estimates from them and
+              whether every exact value lies inside its confidence interval.
+    """
+    if not is_exact_expressible(attacks, defender):
+        raise ValueError("Cross-checking needs a single attack profile without simulation-only rules.")
+    attack = attacks[0]
+    exact = compute_attack(attack, attack["injury_params"], thresholds)
+
+    deviations = []
+    outside = 0
+    intervals = simulation["confidence_intervals"]
+    # Interval of an outcome the simulation never produced
+    unobserved = (0.0, z ** 2 / (simulation["num_simulations"] + z ** 2))
+    pairs = [
+        (exact["out_of_action_probability"], simulation["out_of_action_probability"], intervals["out_of_action_probability"])
+    ]
+    for hits, prob in exact["success_distribution"].items():
+        pairs.append((prob, simulation["hit_distribution"].get(hits, 0.0), intervals["hit_distribution"].get(hits, unobserved)))
+    for markers, prob in exact["blood_marker_distribution"].items():
+        pairs.append((prob, simulation["blood_marker_distribution"].get(markers, 0.0),
+                      intervals["blood_marker_distribution"].get(markers, unobserved)))
+    for exact_prob, estimate, (low, high) in pairs:
+        deviations.append(abs(exact_prob - estimate))
+        outside += not (low <= exact_prob <= high)
+
+    return {
+        "exact_out_of_action_probability": exact["out_of_action_probability"],
+        "max_abs_deviation": max(deviations),
+        "values_outside_interval": outside,
+        "values_checked": len(pairs),
+    }
@@ -0,0 +1,236 @@
+"""
+Precomputed probability tables for the bounded part of the rules space.
+
+`python -m backend.tables` evaluates the math functions over a fixed parameter grid and writes
+one `.npy` file per table plus a manifest. Workers open the files with `mmap_mode="r"`, so all
+processes on a host share a single page-cached copy, and answer in-range requests by indexing
+into them. Requests outside the grid are computed live.
+
+Tables (d = modified_dice, e = extra_d6, f = flat_modifier, t = threshold - flat_modifier):
+- roll_pmf[d, e]: single-roll pmf over the raw dice sum (the flat modifier is only an offset).
+- success_pmf[d, e, t, n]: pmf of successes out of n rolls; every target outside the table has
+  the same success chance as the nearest edge, so only dice and num_rolls are bounded.
+- injury_hit_probabilities[d, e, f, downed]: one marker, two markers and Out of Action per hit.
+- injury_markers[d, e, f, h] / injury_out_of_action[d, e, f, h]: injury state after h hits.
+  Both injury tables only apply under the thresholds they were built with.
+"""
+import json
+import logging
+import os
+
+import numpy as np
+
+from .artifacts import build_lock, versioned_build
+
+logger = logging.getLogger(__name__)
+
+MATH_TABLES_DIR = os.getenv("MATH_TABLES_DIR", "./backend/math_tables")
+
+TABLES_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+TABLE_NAMES = ("roll_pmf", "success_pmf", "injury_hit_probabilities", "injury_markers", "injury_out_of_action")
+
+DIE_FACES = 6
+# Raw sums run from 2 (two dice) to 18 (two dice and the extra d6); a target of 19 never succeeds
+MIN_TARGET = 2
+MAX_TARGET = 3 * DIE_FACES + 1
+
+
+def _normalized_thresholds(thresholds: dict) -> dict:
+    # Thresholds mix ints and (low, high) tuples; JSON turns the tuples into lists
+    return {key: list(value) if isinstance(value, (list, tuple)) else value for key, value in thresholds.items()}
+
+
+class PrecomputedTables:
+    """
+    Read-only lookups into a table directory. Every method returns None for parameters
+    outside the tables, in which case the caller computes the result live.
+    """
+
+    def __init__(self, manifest: dict, arrays: dict):
+        self.manifest = manifest
+        self.dice_min, self.dice_max = manifest["modified_dice"]
+        self.flat_min, self.flat_max = manifest["flat_modifier"]
+        self.max_rolls = manifest["max_rolls"]
+        self.max_hits = manifest["max_hits"]
+        self.thresholds = manifest["injury_thresholds"]
+        self.arrays = arrays
+
+    def _dice_index(self, modified_dice: int):
+        if self.dice_min <= modified_dice <= self.dice_max:
+            return modified_dice - self.dice_min
+        return None
+
+    def _injury_index(self, injury_params: dict, thresholds: dict):
+        dice = self._dice_index(injury_params["modified_dice"])
+        flat = injury_params["flat_modifier"]
+        if dice is None or not self.flat_min <= flat <= self.flat_max:
+            return None
+        if _normalized_thresholds(thresholds) != self.thresholds:
+            return None
+        return dice, int(bool(injury_params["extra_d6"])), flat - self.flat_min
+
+    def roll_pmf(self, modified_dice: int, extra_d6: bool):
+        dice = self._dice_index(modified_dice)
+        if dice is None:
+            return None
+        # Rows are padded to the longest pmf; trim to the length the live computation returns
+        return self.arrays["roll_pmf"][dice, int(extra_d6), :2 * DIE_FACES + 1 + DIE_FACES * int(extra_d6)]
+
+    def success_pmf(self, modified_dice: int, extra_d6: bool, flat_modifier: int, threshold: int, num_rolls: int):
+        dice = self._dice_index(modified_dice)
+        if dice is None or not 0 <= num_rolls <= self.max_rolls:
+            return None
+        target = min(max(threshold - flat_modifier, MIN_TARGET), MAX_TARGET) - MIN_TARGET
+        return self.arrays["success_pmf"][dice, int(extra_d6), target, num_rolls, :num_rolls + 1]
+
+    def success_pmf_batch(self, modified_dice, extra_d6, flat_modifier, threshold, num_rolls):
+        """
+        Success pmfs of many parameter sets (integer arrays) as rows over 0..max(num_rolls) hits,
+        or None unless every set is inside the table.
+        """
+        max_rolls = int(num_rolls.max(initial=0))
+        if max_rolls > self.max_rolls or num_rolls.min(initial=0) < 0:
+            return None
+        if modified_dice.min(initial=self.dice_min) < self.dice_min or modified_dice.max(initial=self.dice_max) > self.dice_max:
+            return None
+        target = np.clip(threshold - flat_modifier, MIN_TARGET, MAX_TARGET) - MIN_TARGET
+        return self.arrays["success_pmf"][modified_dice - self.dice_min, extra_d6, target, num_rolls, :max_rolls + 1]
+
+    def injury_hit_probabilities(self, injury_params: dict, thresholds: dict):
+        index = self._injury_index(injury_params, thresholds)
+        if index is None:
+            return None
+        return self.arrays["injury_hit_probabilities"][index]
+
+    def injury_state_distributions(self, injury_params: dict, thresholds: dict, max_hits: int):
+        index = self._injury_index(injury_params, thresholds)
+        if index is None or max_hits > self.max_hits:
+            return None
+        markers = self.arrays["injury_markers"][index][:max_hits + 1, :2 * max_hits + 1]
+        out_of_action = self.arrays["injury_out_of_action"][index][:max_hits + 1]
+        return np.column_stack((markers, out_of_action))
+
+
+def load_tables(tables_dir: str = MATH_TABLES_DIR):
+    """
+    Memory-map the tables in `tables_dir`.
+
+    Returns:
+        PrecomputedTables | None: The tables, or None if the directory is missing, incomplete
+        or was written by an incompatible build; the math is then computed live.
+    """
+    # Resolved once, so every table comes from the same version even if a build swaps in a new one
+    tables_dir = os.path.realpath(tables_dir)
+    try:
+        with open(os.path.join(tables_dir, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        logger.warning("No precomputed math tables found", extra={"tables_dir": tables_dir})
+        return None
+    if manifest.get("version") != TABLES_VERSION:
+        logger.warning("Ignoring math tables from another version", extra={"tables_dir": tables_dir})
+        return None
+
+    arrays = {}
+    for name in TABLE_NAMES:
+        try:
+            array = np.load(os.path.join(tables_dir, manifest["arrays"][name]["file"]), mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            logger.warning("Math table is missing or unreadable", extra={"table": name, "tables_dir": tables_dir})
+            return None
+        if list(array.shape) != manifest["arrays"][name]["shape"]:
+            logger.warning("Math table does not match its manifest", extra={"table": name, "tables_dir": tables_dir})
+            return None
+        # A plain ndarray view of the same mapping skips np.memmap's Python-level indexing overhead
+        arrays[name] = np.asarray(array)
+    return PrecomputedTables(manifest, arrays)
+
+
+def build_tables(tables_dir: str = MATH_TABLES_DIR, modified_dice=(-3, 3), flat_modifier=(-5, 5),
+                 max_rolls: int = 50, max_hits: int = 50) -> dict:
+    """
+    Compute every table with the live math functions and write them to `tables_dir`.
+
+    The tables are written to a new version directory and `tables_dir`, a symlink, is flipped
+    to it afterwards, like the lore index, so a worker never maps a half-written set.
+
+    Returns:
+        dict: The manifest that was written.
+    """
+    from . import trench_crusade_math as math
+
+    # Build from live computation, never from previously loaded tables
+    previous = math.use_precomputed_tables(None)
+    try:
+        dice_values = range(modified_dice[0], modified_dice[1] + 1)
+        flat_values = range(flat_modifier[0], flat_modifier[1] + 1)
+        targets = range(MIN_TARGET, MAX_TARGET + 1)
+        shape = (len(dice_values), 2)
+
+        roll_pmf = np.zeros(shape + (3 * DIE_FACES + 1,))
+        success_pmf = np.zeros(shape + (len(targets), max_rolls + 1, max_rolls + 1))
+        hit_probabilities = np.zeros(shape + (len(flat_values), 2, 3))
+        markers = np.zeros(shape + (len(flat_values), max_hits + 1, 2 * max_hits + 1))
+        out_of_action = np.zeros(shape + (len(flat_values), max_hits + 1))
+
+        for d, dice in enumerate(dice_values):
+            for extra_d6 in (False, True):
+                e = int(extra_d6)
+                pmf, _ = math.roll_pmf(dice, extra_d6, 0)
+                roll_pmf[d, e, :len(pmf)] = pmf
+                for t, target in enumerate(targets):
+                    for num_rolls in range(max_rolls + 1):
+                        distribution = math.compute_success_distribution(dice, num_rolls, extra_d6, 0, target)
+                        success_pmf[d, e, t, num_rolls, :num_rolls + 1] = [distribution[k] for k in range(num_rolls + 1)]
+                for f, flat in enumerate(flat_values):
+                    injury_params = {"modified_dice": dice, "extra_d6": extra_d6, "flat_modifier": flat}
+                    hit_probabilities[d, e, f] = math.injury_hit_probabilities(injury_params, math.injury_thresholds)
+                    states = math.injury_state_distributions(injury_params, math.injury_thresholds, max_hits)
+                    markers[d, e, f] = states[:, :-1]
+                    out_of_action[d, e, f] = states[:, -1]
+    finally:
+        math.use_precomputed_tables(previous)
+
+    arrays = {
+        "roll_pmf": roll_pmf,
+        "success_pmf": success_pmf,
+        "injury_hit_probabilities": hit_probabilities,
+        "injury_markers": markers,
+        "injury_out_of_action": out_of_action,
+    }
+    manifest = {
+        "version": TABLES_VERSION,
+        "modified_dice": list(modified_dice),
+        "flat_modifier": list(flat_modifier),
+        "max_rolls": max_rolls,
+        "max_hits": max_hits,
+        "injury_thresholds": _normalized_thresholds(math.injury_thresholds),
+        "arrays": {
+            name: {"file": f"{name}.npy", "shape": list(array.shape), "dtype": str(array.dtype)}
+            for name, array in arrays.items()
+        },
+    }
+
+    with build_lock(tables_dir), versioned_build(tables_dir) as version_dir:
+        for name, array in arrays.items():
+            np.save(os.path.join(version_dir, f"{name}.npy"), array)
+        with open(os.path.join(version_dir, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+    logger.info("Math tables written", extra={"tables_dir": tables_dir, "bytes": sum(a.nbytes for a in arrays.values())})
+    return manifest
+
+
+if __name__ == "__main__":
+    import argparse
+    from .logging_config import configure_logging
+
+    configure_logging(names=(__package__, __name__))
+    parser = argparse.ArgumentParser(description="Precompute the dice math tables served by the math routes.")
+    parser.add_argument("--tables-dir", default=MATH_TABLES_DIR)
+    parser.add_argument("--modified-dice", type=int, nargs=2, default=(-3, 3), metavar=("MIN", "MAX"))
+    parser.add_argument("--flat-modifier", type=int, nargs=2, default=(-5, 5), metavar=("MIN", "MAX"))
+    parser.add_argument("--max-rolls", type=int, default=50)
+    parser.add_argument("--max-hits", type=int, default=50)
+    args = parser.parse_args()
+    build_tables(args.tables_dir, tuple(args.modified_dice), tuple(args.flat_modifier), args.max_rolls, args.max_hits)
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import os
 from collections import Counter
-from itertools import combinations_with_replacement, product
-from scipy.stats import binom
-import matplotlib.pyplot as plt
+import numpy as np
+
+from .cache import LRUCache, cached
+from .dice import MAX_DICE, evaluate
+from .metrics import register_cache, timed
+from .tables import load_tables
 
 # Thresholds for injury rolls
 injury_thresholds = {
@@ -13,6 +17,100 @@ injury_thresholds = {
     "out_of_action": 9
 }
 
+DIE_FACES = 6
+# Rolls take 2 + |modified_dice| dice, and a downed unit's injury roll one more
+MAX_MODIFIED_DICE = MAX_DICE - 3
+# Bound on flat modifiers and thresholds: far past any roll, and small enough for the int64 batch math
+MAX_ROLL_OFFSET = 1000
+
+# Shared memo of all roll distributions, keyed on normalized parameters (thresholds included)
+DISTRIBUTION_CACHE = LRUCache(maxsize=int(os.getenv("DISTRIBUTION_CACHE_SIZE", "4096")))
+register_cache("distribution", DISTRIBUTION_CACHE)
+
+# Tables built by `python -m backend.tables`, memory-mapped; parameters outside them are computed live
+USE_MATH_TABLES = os.getenv("USE_MATH_TABLES", "false").lower() == "true"
+PRECOMPUTED_TABLES = load_tables() if USE_MATH_TABLES else None
+
+
+def use_precomputed_tables(tables):
+    """
+    Serve lookups from `tables` (None to always compute live) and drop cached results.
+
+    Returns:
+        The tables used before.
+    """
+    global PRECOMPUTED_TABLES
+    previous, PRECOMPUTED_TABLES = PRECOMPUTED_TABLES, tables
+    DISTRIBUTION_CACHE.clear()
+    return previous
+
+
+def _frozen(array: np.ndarray) -> np.ndarray:
+    # Cached arrays are shared between callers, so make them read-only
+    array.setflags(write=False)
+    return array
+
+
+def binomial_pmf(k, n, p) -> np.ndarray:
+    """
+    Binomial probability of exactly `k` successes in `n` trials with success probability `p`.
+
+    Arguments broadcast against each other like numpy ufuncs; `k` outside 0..n has probability 0.
+    Computed in log space with numpy only, so the math module doesn't need scipy.stats
+    (which alone takes about a second to import).
+    """
+    k, n, p = np.broadcast_arrays(np.asarray(k, dtype=int), np.asarray(n, dtype=int), np.asarray(p, dtype=float))
+    valid = (k >= 0) & (k <= n)
+    k, n = np.where(valid, k, 0), np.where(valid, n, 0)
+
+    log_factorial = np.concatenate(([0.0], np.cumsum(np.log(np.arange(1, int(n.max(initial=0)) + 1)))))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # 0 * log(0) terms are 0, so that p = 0 or 1 gives exact point masses
+        log_p = np.where(k > 0, k * np.log(p), 0.0)
+        log_q = np.where(n - k > 0, (n - k) * np.log1p(-p), 0.0)
+    log_pmf = log_factorial[n] - log_factorial[k] - log_factorial[n - k] + log_p + log_q
+    return np.where(valid, np.exp(log_pmf), 0.0)
+
+
+def roll_expression(modified_dice: int = 0, extra_d6: bool = False) -> str:
+    """
+    The dice expression of a roll without its flat modifier: 2d6 plus the modified dice,
+    keeping the two highest on advantage or the two lowest on disadvantage, plus the extra d6.
+    """
+    num_dice = 2 + abs(modified_dice)
+    expression = f"{num_dice}d{DIE_FACES}"
+    if modified_dice:
+        expression += "kh2" if modified_dice > 0 else "kl2"
+    if extra_d6:
+        expression += f"+1d{DIE_FACES}"
+    return expression
+
+
+@cached(DISTRIBUTION_CACHE)
+def roll_pmf(modified_dice: int = 0, extra_d6: bool = False, flat_modifier: int = 0):
+    """
+    Compute the distribution of a single roll as a probability array.
+
+    Args:
+        modified_dice (int): The number of additional or fewer dice compared to 2d6.
+        extra_d6 (bool): Whether to add an extra die outside of the advantage/disadvantage mechanics.
+        flat_modifier (int): A flat value added to or subtracted from the final result.
+
+    Returns:
+        tuple[np.ndarray, int]: (pmf, offset) where pmf[i] is the probability of a result of i + offset.
+    """
+    if PRECOMPUTED_TABLES is not None:
+        pmf = PRECOMPUTED_TABLES.roll_pmf(modified_dice, extra_d6)
+        if pmf is not None:
+            return pmf, flat_modifier
+
+    # Pad the dice sum's pmf to start at 0, so the flat modifier is the whole offset
+    pmf, offset = evaluate(roll_expression(modified_dice, extra_d6))
+    return _frozen(np.concatenate((np.zeros(offset), pmf))), flat_modifier
+
+
+@timed()
+@cached(DISTRIBUTION_CACHE, copy=Counter)
 def compute(modified_dice: int = 0, extra_d6: bool = False, flat_modifier: int = 0):
     """
     Compute the distribution of outcomes for varying types of rolls.
@@ -30,43 +128,14 @@ def compute(modified_dice: int = 0, extra_d6: bool = False, flat_modifier: int =
     Returns:
         Counter: Distribution of outcomes as {sum: probability}.
     """
-    base_dice = 2  # Baseline is 2d6
-    num_dice = base_dice + abs(modified_dice)
-    if num_dice < 2:
-        raise ValueError("Number of dice cannot be less than 2.")
-
-    # Generate all possible outcomes for the main rolls
-    all_rolls = combinations_with_replacement(range(1, 7), num_dice)
-
-    # Calculate sums based on modified_dice
-    if modified_dice > 0:  # Advantage: select top 2
-        selected_sums = [sum(sorted(roll, reverse=True)[:2]) for roll in all_rolls]
-    elif modified_dice < 0:  # Disadvantage: select bottom 2
-        selected_sums = [sum(sorted(roll)[:2]) for roll in all_rolls]
-    else:  # No modification: just sum the two dice
-        selected_sums = [sum(roll) for roll in all_rolls]
-
-    # If extra_d6 is True, add an additional roll
-    if extra_d6:
-        # Generate all possible outcomes for the extra d6
-        extra_die_rolls = range(1, 7)
-        extended_sums = []
-        for selected_sum in selected_sums:
-            for extra_roll in extra_die_rolls:
-                extended_sums.append(selected_sum + extra_roll)
-        selected_sums = extended_sums
-
-    # Apply the flat modifier
-    modified_sums = [s + flat_modifier for s in selected_sums]
-
-    # Compute probabilities
-    total_outcomes = len(selected_sums)
-    distribution = Counter(modified_sums)
-    for key in distribution:
-        distribution[key] /= total_outcomes
-
-    return distribution
-
+    pmf, offset = roll_pmf(modified_dice, extra_d6, flat_modifier)
+    return Counter({
+        int(value) + offset: float(pmf[value])
+        for value in np.flatnonzero(pmf > 0)
+    })
+
+@timed()
+@cached(DISTRIBUTION_CACHE, copy=dict)
 def compute_success_distribution(modified_dice: int=0, num_rolls: int=1, extra_d6: bool=False, flat_modifier: int=0, threshold: int=7, ):
     """
     Compute the distribution of successes for a given number of rolls.
@@ -81,21 +150,170 @@ def compute_success_distribution(modified_dice: int=0, num_rolls: int=1, extra_d
     Returns:
         dict: The distribution of successes as {success_count: probability}.
     """
+    if PRECOMPUTED_TABLES is not None:
+        pmf = PRECOMPUTED_TABLES.success_pmf(modified_dice, extra_d6, flat_modifier, threshold, num_rolls)
+        if pmf is not None:
+            return dict(enumerate(pmf.tolist()))
+
     # Compute the distribution of single roll outcomes
     outcome_distribution = compute(modified_dice, extra_d6, flat_modifier)
+    return successes_from_distribution(outcome_distribution, num_rolls, threshold)
+
 
+def successes_from_distribution(outcome_distribution: dict, num_rolls: int, threshold: int) -> dict:
+    """
+    Distribution of successes over `num_rolls` independent rolls with the given outcome distribution.
+
+    Returns:
+        dict: The distribution of successes as {success_count: probability}.
+    """
     # Compute the probability of a single roll being a success
     success_probability = sum(prob for outcome, prob in outcome_distribution.items() if outcome >= threshold)
 
-    # Use the binomial distribution to compute the probability of 0, 1, ..., num_rolls successes
-    success_distribution = {
-        k: binom.pmf(k, num_rolls, success_probability)
-        for k in range(num_rolls + 1)
+    # Use the binomial distribution to compute the probability of 0, 1, ..., num_rolls successes at once
+    success_distribution = binomial_pmf(np.arange(num_rolls + 1), num_rolls, success_probability)
+    return dict(enumerate(success_distribution.tolist()))
+
+
+@timed()
+def compute_mixed_success_distribution(profiles: list) -> dict:
+    """
+    Compute the distribution of successes of a volley mixing different kinds of rolls.
+
+    The rolls of each distinct success chance give a binomial distribution of successes;
+    the volley's is their convolution (a Poisson binomial distribution). All binomials are
+    evaluated in one call and convolved at once by multiplying their spectra, so the cost
+    barely depends on the number of profiles.
+
+    Args:
+        profiles (list[dict]): Roll parameters (modified_dice, extra_d6, flat_modifier, threshold, num_rolls),
+                               one entry per kind of roll with num_rolls rolls of that kind.
+
+    Returns:
+        dict: `pmf` and `cdf` arrays over 0..total rolls successes, the per-profile `success_probability`
+              and the `expected_successes`.
+    """
+    probabilities = []
+    tails = {}
+    for profile in profiles:
+        key = (profile.get("modified_dice", 0), bool(profile.get("extra_d6", False)), profile.get("flat_modifier", 0))
+        if key not in tails:
+            pmf, offset = roll_pmf(*key)
+            # tail[i]: probability of a result of at least i + offset
+            tails[key] = np.cumsum(pmf[::-1])[::-1].tolist() + [0.0], offset
+        tail, offset = tails[key]
+        probabilities.append(tail[min(max(profile.get("threshold", 7) - offset, 0), len(tail) - 1)])
+    probabilities = np.array(probabilities)
+    num_rolls = np.array([profile.get("num_rolls", 1) for profile in profiles], dtype=int)
+    total_rolls = int(num_rolls.sum())
+
+    # Rolls with the same chance add up to a single binomial
+    counts = {}
+    for probability, rolls in zip(probabilities.tolist(), num_rolls.tolist()):
+        counts[probability] = counts.get(probability, 0) + rolls
+    unique_probabilities, counts = np.array(list(counts)), np.array(list(counts.values()), dtype=int)
+
+    # One binomial per distinct chance, over 0..its own rolls successes
+    hits = np.arange(int(counts.max(initial=0)) + 1)
+    binomials = binomial_pmf(hits[None, :], counts[:, None], unique_probabilities[:, None])
+    if len(binomials) > 1:
+        # The convolution spans total_rolls + 1 entries, so any longer transform doesn't wrap around
+        size = 1 << total_rolls.bit_length()
+        spectrum = np.fft.rfft(binomials, n=size, axis=1).prod(axis=0)
+        # Round-off leaves entries of about 1e-17 where the probability is 0 or tiny. Exactly
+        # impossible counts are those below the rolls that always succeed or above the ones that
+        # can succeed at all; they are zeroed outright, and tiny negative entries clipped
+        pmf = np.clip(np.fft.irfft(spectrum, n=size)[:total_rolls + 1], 0.0, None)
+        certain = int(counts[unique_probabilities >= 1].sum())
+        possible = total_rolls - int(counts[unique_probabilities <= 0].sum())
+        pmf[:certain] = 0.0
+        pmf[possible + 1:] = 0.0
+        pmf /= pmf.sum()
+    else:
+        pmf = binomials[0] if len(binomials) else np.ones(1)
+
+    return {
+        "pmf": pmf,
+        "cdf": np.minimum(np.cumsum(pmf), 1.0),
+        "success_probability": probabilities,
+        "expected_successes": float(num_rolls @ probabilities),
     }
 
-    return success_distribution
 
+@timed()
+@cached(DISTRIBUTION_CACHE, copy=Counter)
+def compute_expression(expression: str):
+    """
+    Compute the distribution of an arbitrary dice expression, such as "3d6kh2+1d6-1"
+    (see `backend.dice` for the syntax).
+
+    Raises:
+        DiceExpressionError: If the expression is malformed or out of bounds.
+
+    Returns:
+        Counter: Distribution of outcomes as {result: probability}.
+    """
+    pmf, offset = evaluate(expression)
+    return Counter({
+        int(value) + offset: float(pmf[value])
+        for value in np.flatnonzero(pmf > 0)
+    })
+
+
+@cached(DISTRIBUTION_CACHE)
+def injury_hit_probabilities(injury_params: dict, thresholds: dict) -> np.ndarray:
+    """
+    Compute the outcome probabilities of a single injury roll, for a unit that is
+    not yet downed and for one that is.
+
+    Rolls that have no effect are excluded and the remaining outcomes normalized,
+    matching how hits are resolved in `compute_injury_outcome_refined`.
+
+    Args:
+        injury_params (dict): Parameters for the injury roll (modified_dice, extra_d6, flat_modifier).
+        thresholds (dict): Thresholds for injury outcomes.
 
+    Returns:
+        np.ndarray: Array of shape (2, 3) indexed by [is_downed, outcome], where the outcomes are
+                    one blood marker, two blood markers and Out of Action. A row is all zero
+                    when no injury roll can have an effect.
+    """
+    if PRECOMPUTED_TABLES is not None:
+        probabilities = PRECOMPUTED_TABLES.injury_hit_probabilities(injury_params, thresholds)
+        if probabilities is not None:
+            return probabilities
+
+    probabilities = np.zeros((2, 3))
+    for is_downed in (False, True):
+        # Downed units take an additional injury die
+        pmf, offset = roll_pmf(
+            modified_dice=injury_params['modified_dice'] + (1 if is_downed else 0),
+            extra_d6=injury_params['extra_d6'],
+            flat_modifier=injury_params['flat_modifier']
+        )
+        rolls = np.arange(len(pmf)) + offset
+
+        blood = (thresholds['blood_marker'][0] <= rolls) & (rolls <= thresholds['blood_marker'][1])
+        downed = (thresholds['downed'][0] <= rolls) & (rolls <= thresholds['downed'][1])
+        out_of_action = rolls >= thresholds['out_of_action']
+        effect = rolls > thresholds['no_effect']
+
+        row = probabilities[int(is_downed)]
+        row[0] = pmf[effect & blood].sum()
+        # A downed result on a downed unit adds two markers, otherwise it downs the unit with one
+        if is_downed:
+            row[1] = pmf[effect & ~blood & downed].sum()
+        else:
+            row[0] += pmf[effect & ~blood & downed].sum()
+        row[2] = pmf[effect & ~blood & ~downed & out_of_action].sum()
+        # The row stays all zero if no roll can have an effect
+        if row.sum() > 0:
+            row /= row.sum()
+
+    return _frozen(probabilities)
+
+
+@cached(DISTRIBUTION_CACHE, copy=lambda result: (Counter(result[0]), result[1]))
 def compute_blood_markers_for_hit(injury_params: dict, thresholds: dict, is_downed: bool = False):
     """
     Compute the blood marker distribution for a single injury roll.
@@ -108,44 +326,81 @@ def compute_blood_markers_for_hit(injury_params: dict, thresholds: dict, is_down
     Returns:
         dict: Distribution of blood markers for a single injury roll.
     """
-    # Adjust modified_dice if the unit is Downed
-    modified_dice = injury_params['modified_dice'] + (1 if is_downed else 0)
-
-    # Compute the injury roll distribution
-    injury_roll_distribution = compute(
-        modified_dice=modified_dice,
-        extra_d6=injury_params['extra_d6'],
-        flat_modifier=injury_params['flat_modifier']
-    )
-    print(injury_roll_distribution)
+    one_marker, two_markers, out_of_action_probability = injury_hit_probabilities(injury_params, thresholds)[int(is_downed)]
 
     blood_marker_distribution = Counter()
-    out_of_action_probability = 0
+    if one_marker > 0:
+        blood_marker_distribution[1] = float(one_marker)
+    if two_markers > 0:
+        blood_marker_distribution[2] = float(two_markers)
 
-    # Classify outcomes based on thresholds
-    for roll, prob in injury_roll_distribution.items():
-        if roll <= thresholds['no_effect']:
-            continue  # No effect
-        elif thresholds['blood_marker'][0] <= roll <= thresholds['blood_marker'][1]:
-            blood_marker_distribution[1] += prob
-        elif thresholds['downed'][0] <= roll <= thresholds['downed'][1]:
-            if is_downed:
-                blood_marker_distribution[2] += prob
-            else:
-                blood_marker_distribution[1] += prob
-                is_downed = True
-        elif roll >= thresholds['out_of_action']:
-            out_of_action_probability += prob
+    return blood_marker_distribution, float(out_of_action_probability)
 
-    # Normalize probabilities
-    total_prob = sum(blood_marker_distribution.values()) + out_of_action_probability
-    for key in blood_marker_distribution:
-        blood_marker_distribution[key] /= total_prob
 
-    return blood_marker_distribution, out_of_action_probability / total_prob
+def injury_transition_matrix(injury_params: dict, thresholds: dict, max_markers: int) -> np.ndarray:
+    """
+    Build the per-hit transition matrix of the injury Markov chain.
 
+    States 0..max_markers are the number of blood markers on the unit (any marker
+    means it is downed); the final state is the absorbing Out of Action state.
+    Marker counts beyond max_markers are clamped into the last marker state.
 
+    Args:
+        injury_params (dict): Parameters for the injury rolls (modified_dice, extra_d6, flat_modifier).
+        thresholds (dict): Thresholds for injury outcomes.
+        max_markers (int): The largest blood marker count tracked.
+
+    Returns:
+        np.ndarray: Row-stochastic matrix of shape (max_markers + 2, max_markers + 2).
+    """
+    hit_probabilities = injury_hit_probabilities(injury_params, thresholds)
+    out_of_action_state = max_markers + 1
+
+    transition = np.zeros((max_markers + 2, max_markers + 2))
+    for markers in range(max_markers + 1):
+        one_marker, two_markers, out_of_action = hit_probabilities[int(markers > 0)]
+        transition[markers, min(markers + 1, max_markers)] += one_marker
+        transition[markers, min(markers + 2, max_markers)] += two_markers
+        transition[markers, out_of_action_state] = out_of_action
+        if one_marker + two_markers + out_of_action == 0:
+            # No injury roll can have an effect, so hits leave the unit as it is
+            transition[markers, markers] = 1.0
+    transition[out_of_action_state, out_of_action_state] = 1.0
+
+    return transition
+
+
+@cached(DISTRIBUTION_CACHE)
+def injury_state_distributions(injury_params: dict, thresholds: dict, max_hits: int) -> np.ndarray:
+    """
+    Compute the injury state distribution after exactly 0..max_hits hits.
+
+    Args:
+        injury_params (dict): Parameters for the injury rolls (modified_dice, extra_d6, flat_modifier).
+        thresholds (dict): Thresholds for injury outcomes.
+        max_hits (int): The largest number of hits to resolve.
+
+    Returns:
+        np.ndarray: Array of shape (max_hits + 1, 2 * max_hits + 2). Row h holds the probability of
+                    0..2 * max_hits blood markers after h hits, with Out of Action in the last column.
+    """
+    if PRECOMPUTED_TABLES is not None:
+        states = PRECOMPUTED_TABLES.injury_state_distributions(injury_params, thresholds, max_hits)
+        if states is not None:
+            return _frozen(states)
+
+    # Each hit adds at most two markers, so the marker states never need clamping
+    transition = injury_transition_matrix(injury_params, thresholds, 2 * max_hits)
+
+    states = np.zeros((max_hits + 1, len(transition)))
+    states[0, 0] = 1.0  # Start with no blood markers
+    for hits in range(1, max_hits + 1):
+        states[hits] = states[hits - 1] @ transition
+
+    return _frozen(states)
 
+
+@timed()
 def compute_injury_outcome_refined(hit_distribution: dict, injury_params: dict, thresholds: dict):
     """
     Refined computation of blood marker and Out of Action probabilities.
@@ -155,58 +410,179 @@ def compute_injury_outcome_refined(hit_distribution: dict, injury_params: dict,
         injury_params (dict): Parameters for the injury rolls (modified_dice, extra_d6, flat_modifier).
         thresholds (dict): Thresholds for injury outcomes.
 
+    Raises:
+        ValueError: If the hit distribution is empty, has a negative hit count or no positive probability.
+
     Returns:
         dict: Combined distribution of blood markers and Out of Action probabilities.
     """
-    combined_blood_marker_distribution = Counter()
-    total_out_of_action_probability = 0
+    hits = np.fromiter(hit_distribution.keys(), dtype=int, count=len(hit_distribution))
+    hit_probs = np.fromiter(hit_distribution.values(), dtype=float, count=len(hit_distribution))
+    if not len(hits) or hits.min() < 0 or hit_probs.min() < 0 or not hit_probs.sum() > 0:
+        raise ValueError("The hit distribution needs non-negative hit counts and probabilities with a positive total")
 
-    # Iterate over each possible number of hits and its probability
-    for hits, hit_prob in hit_distribution.items():
-        # Initialize the state for the current hit count
-        blood_marker_distribution = Counter({0: 1.0})  # Start with no blood markers
-        out_of_action_probability = 0
+    # Weight the state distribution after each number of hits by the chance of scoring that many
+    states = injury_state_distributions(injury_params, thresholds, int(hits.max()))
+    combined = hit_probs @ states[hits]
 
-        for _ in range(hits):
-            new_blood_marker_distribution = Counter()
-            for current_blood_markers, current_prob in blood_marker_distribution.items():
-                # Compute the blood marker distribution for a single hit
-                is_downed = current_blood_markers > 0  # Unit is downed if it already has markers
-                single_blood_distribution, single_out_action_prob = compute_blood_markers_for_hit(
-                    injury_params, thresholds, is_downed
-                )
+    # Normalize combined probabilities
+    combined /= combined.sum()
+    blood_marker_probs, out_of_action_probability = combined[:-1], combined[-1]
 
-                # Update the blood marker distribution for this hit
-                for blood, prob in single_blood_distribution.items():
-                    new_blood_marker_distribution[current_blood_markers + blood] += current_prob * prob
+    combined_blood_marker_distribution = Counter({
+        int(markers): float(blood_marker_probs[markers])
+        for markers in np.flatnonzero(blood_marker_probs > 0)
+    })
+
+    return {
+        "blood_marker_distribution": combined_blood_marker_distribution,
+        "out_of_action_probability": float(out_of_action_probability)
+    }
 
-                # Update Out of Action probability
-                out_of_action_probability += current_prob * single_out_action_prob
 
-            blood_marker_distribution = new_blood_marker_distribution
+@timed()
+def compute_batch(modified_dice, extra_d6, flat_modifier, threshold, num_rolls,
+                  injury_modified_dice, injury_extra_d6, injury_flat_modifier, thresholds: dict):
+    """
+    Evaluate hit and injury outcomes for many parameter sets at once.
 
-        # Combine the results for this hit count
-        for blood, prob in blood_marker_distribution.items():
-            combined_blood_marker_distribution[blood] += hit_prob * prob
-        total_out_of_action_probability += hit_prob * out_of_action_probability
+    Every argument but `thresholds` is a sequence with one entry per parameter set.
+    Single-roll distributions and injury chains are computed once per distinct
+    parameter combination and shared by all sets that use them.
 
-    # Normalize combined probabilities
-    total_prob = sum(combined_blood_marker_distribution.values()) + total_out_of_action_probability
-    for key in combined_blood_marker_distribution:
-        combined_blood_marker_distribution[key] /= total_prob
+    Args:
+        modified_dice, extra_d6, flat_modifier (sequence): Hit roll parameters.
+        threshold (sequence): The minimum value required for a hit roll to succeed.
+        num_rolls (sequence): The number of hit rolls.
+        injury_modified_dice, injury_extra_d6, injury_flat_modifier (sequence): Injury roll parameters.
+        thresholds (dict): Thresholds for injury outcomes.
+
+    Returns:
+        dict: Columnar results. `success_distribution` has one row per set over 0..max(num_rolls) hits,
+              `blood_marker_distribution` one row per set over 0..2 * max(num_rolls) blood markers.
+    """
+    hit_keys = np.column_stack([modified_dice, extra_d6, flat_modifier]).astype(int)
+    injury_keys = np.column_stack([injury_modified_dice, injury_extra_d6, injury_flat_modifier]).astype(int)
+    threshold = np.asarray(threshold, dtype=int)
+    num_rolls = np.asarray(num_rolls, dtype=int)
+    max_rolls = int(num_rolls.max(initial=0))
+
+    # Probability of a single hit roll meeting its threshold, from each distinct roll distribution
+    unique_hits, hit_index = np.unique(hit_keys, axis=0, return_inverse=True)
+    success_probability = np.empty(len(hit_keys))
+    for i, (dice, extra, flat) in enumerate(unique_hits):
+        pmf, offset = roll_pmf(int(dice), bool(extra), int(flat))
+        at_least = np.concatenate((np.cumsum(pmf[::-1])[::-1], [0.0]))
+        rows = hit_index.ravel() == i
+        success_probability[rows] = at_least[np.clip(threshold[rows] - offset, 0, len(pmf))]
+
+    success_distribution = None
+    if PRECOMPUTED_TABLES is not None:
+        success_distribution = PRECOMPUTED_TABLES.success_pmf_batch(*hit_keys.T, threshold, num_rolls)
+    if success_distribution is None:
+        hits = np.arange(max_rolls + 1)
+        success_distribution = binomial_pmf(hits[None, :], num_rolls[:, None], success_probability[:, None])
+
+    # Weight the injury chain of each distinct injury profile by the hit distributions using it
+    unique_injuries, injury_index = np.unique(injury_keys, axis=0, return_inverse=True)
+    injury_outcome = np.empty((len(injury_keys), 2 * max_rolls + 2))
+    for i, (dice, extra, flat) in enumerate(unique_injuries):
+        injury_params = {"modified_dice": int(dice), "extra_d6": bool(extra), "flat_modifier": int(flat)}
+        rows = injury_index.ravel() == i
+        injury_outcome[rows] = success_distribution[rows] @ injury_state_distributions(injury_params, thresholds, max_rolls)
+    injury_outcome /= injury_outcome.sum(axis=1, keepdims=True)
 
     return {
-        "blood_marker_distribution": combined_blood_marker_distribution,
-        "out_of_action_probability": total_out_of_action_probability / total_prob
+        "success_probability": success_probability,
+        "expected_hits": num_rolls * success_probability,
+        "success_distribution": success_distribution,
+        "blood_marker_distribution": injury_outcome[:, :-1],
+        "out_of_action_probability": injury_outcome[:, -1],
     }
 
 
-def plot_distributions_with_out_of_action_fixed(hit_distribution, injury_outcome):
+@timed()
+def compute_attack(hit_params: dict, injury_params: dict, thresholds: dict):
     """
-    Plot the hit success distribution and injury outcome distributions,
+    Compute the hit distribution of an attack and the injury outcome it inflicts in one pass.
+
+    Args:
+        hit_params (dict): Parameters for the hit rolls (modified_dice, extra_d6, flat_modifier, threshold, num_rolls).
+        injury_params (dict): Parameters for the injury rolls (modified_dice, extra_d6, flat_modifier).
+        thresholds (dict): Thresholds for injury outcomes.
+
+    Returns:
+        dict: The success distribution as {success_count: probability}, the blood marker
+              distribution as {blood_markers: probability} and the Out of Action probability.
+    """
+    result = compute_batch(
+        modified_dice=[hit_params.get("modified_dice", 0)],
+        extra_d6=[hit_params.get("extra_d6", False)],
+        flat_modifier=[hit_params.get("flat_modifier", 0)],
+        threshold=[hit_params.get("threshold", 7)],
+        num_rolls=[hit_params.get("num_rolls", 1)],
+        injury_modified_dice=[injury_params["modified_dice"]],
+        injury_extra_d6=[injury_params["extra_d6"]],
+        injury_flat_modifier=[injury_params["flat_modifier"]],
+        thresholds=thresholds
+    )
+    success_distribution = result["success_distribution"][0]
+    blood_marker_probs = result["blood_marker_distribution"][0]
+
+    return {
+        "success_distribution": {hits: float(prob) for hits, prob in enumerate(success_distribution)},
+        "blood_marker_distribution": Counter({
+            int(markers): float(blood_marker_probs[markers])
+            for markers in np.flatnonzero(blood_marker_probs > 0)
+        }),
+        "out_of_action_probability": float(result["out_of_action_probability"][0])
+    }
+
+
+def set_injury_thresholds(thresholds: dict):
+    """
+    Replace the injury thresholds and drop every cached distribution.
+
+    Args:
+        thresholds (dict): New thresholds for injury outcomes.
+    """
+    injury_thresholds.clear()
+    injury_thresholds.update(thresholds)
+    # The injury tables stop matching and are skipped from here on; the other tables still apply
+    DISTRIBUTION_CACHE.clear()
+
+
+def prewarm_distribution_cache(modified_dice=range(-3, 4), flat_modifiers=range(-5, 6)):
+    """
+    Fill the distribution cache with the common parameter grid.
+
+    Args:
+        modified_dice (iterable): The dice modifiers to precompute.
+        flat_modifiers (iterable): The flat modifiers to precompute.
+
+    Returns:
+        dict: Cache statistics after prewarming.
+    """
+    for dice in modified_dice:
+        for extra_d6 in (False, True):
+            for flat_modifier in flat_modifiers:
+                compute(dice, extra_d6, flat_modifier)
+                injury_params = {"modified_dice": dice, "extra_d6": extra_d6, "flat_modifier": flat_modifier}
+                for is_downed in (False, True):
+                    compute_blood_markers_for_hit(injury_params, injury_thresholds, is_downed)
+    return DISTRIBUTION_CACHE.stats()
+
+
+def draw_distributions_with_out_of_action(figure, hit_distribution, injury_outcome):
+    """
+    Draw the hit success distribution and injury outcome distributions onto a matplotlib figure,
     including "Out of Action" as a separate red bar on the blood marker chart.
 
+    Only the object-oriented API is used, so this is safe on any figure, including
+    ones rendered off-screen in worker threads or processes.
+
     Args:
+        figure (matplotlib.figure.Figure): The figure to draw on.
         hit_distribution (dict): Distribution of successful hits as {hits: probability}.
         injury_outcome (dict): Distribution of injury outcomes containing blood_marker_distribution and out_of_action_probability.
     """
@@ -217,32 +593,45 @@ def plot_distributions_with_out_of_action_fixed(hit_distribution, injury_outcome
     # Prepare hit distribution data
     hits, hit_probs = zip(*sorted(hit_distribution.items()))
 
-    # Prepare blood marker distribution data
-    blood_markers = list(blood_marker_distribution.keys()) + [max(blood_marker_distribution.keys()) + 1]
+    # Prepare blood marker distribution data; it is empty when the unit always goes Out of Action
     blood_probs = list(blood_marker_distribution.values()) + [out_of_action_probability]
     labels = list(map(str, blood_marker_distribution.keys())) + ["Out of Action"]
 
     # Plot hit success distribution
-    plt.figure(figsize=(12, 5))
-
-    plt.subplot(1, 2, 1)
-    plt.bar(hits, hit_probs, width=0.8, edgecolor='black', alpha=0.7)
-    plt.title("Hit Success Distribution")
-    plt.xlabel("Number of Hits")
-    plt.ylabel("Probability")
-    plt.xticks(hits)
-    plt.grid(axis="y", linestyle="--", alpha=0.7)
+    hit_axes, injury_axes = figure.subplots(1, 2)
+    hit_axes.bar(hits, hit_probs, width=0.8, edgecolor='black', alpha=0.7)
+    hit_axes.set_title("Hit Success Distribution")
+    hit_axes.set_xlabel("Number of Hits")
+    hit_axes.set_ylabel("Probability")
+    hit_axes.set_xticks(hits)
+    hit_axes.grid(axis="y", linestyle="--", alpha=0.7)
 
     # Plot injury outcome distribution
-    plt.subplot(1, 2, 2)
     bar_colors = ['blue'] * len(blood_marker_distribution) + ['red']
-    plt.bar(range(len(blood_markers)), blood_probs, width=0.8, edgecolor='black', alpha=0.7, color=bar_colors)
-    plt.title("Injury Outcome Distribution")
-    plt.xlabel("Outcome")
-    plt.ylabel("Probability")
-    plt.xticks(range(len(blood_markers)), labels, rotation=45)
-    plt.grid(axis="y", linestyle="--", alpha=0.7)
+    injury_axes.bar(range(len(labels)), blood_probs, width=0.8, edgecolor='black', alpha=0.7, color=bar_colors)
+    injury_axes.set_title("Injury Outcome Distribution")
+    injury_axes.set_xlabel("Outcome")
+    injury_axes.set_ylabel("Probability")
+    injury_axes.set_xticks(range(len(labels)), labels, rotation=45)
+    injury_axes.grid(axis="y", linestyle="--", alpha=0.7)
+
+    figure.tight_layout()
+
+
+def plot_distributions_with_out_of_action_fixed(hit_distribution, injury_outcome):
+    """
+    Plot the hit success distribution and injury outcome distributions,
+    including "Out of Action" as a separate red bar on the blood marker chart.
+
+    Args:
+        hit_distribution (dict): Distribution of successful hits as {hits: probability}.
+        injury_outcome (dict): Distribution of injury outcomes containing blood_marker_distribution and out_of_action_probability.
+    """
+    # Plotting is only used interactively, so don't make every importer pay for pyplot
+    import matplotlib.pyplot as plt
+
+    figure = plt.figure(figsize=(12, 5))
+    draw_distributions_with_out_of_action(figure, hit_distribution, injury_outcome)
 
     # Show plots
-    plt.tight_layout()
     plt.show()
@@ -0,0 +1,104 @@
+import os
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel
+
+from .database import get_db, pool_stats
+from .models import InputText, User
+from .auth import get_current_user, get_current_user_claims
+from .roster import roster_hash
+
+router = APIRouter()
+
+# Rows per INSERT statement; every batch is one round trip, all batches one transaction
+SUBMIT_BATCH_SIZE = int(os.getenv("SUBMIT_BATCH_SIZE", "1000"))
+MAX_BULK_TEXTS = int(os.getenv("MAX_BULK_TEXTS", "10000"))
+
+
+async def _insert_new_texts(db: AsyncSession, rows: list) -> int:
+    """
+    Insert one batch of input texts in a single statement, skipping texts the owner already stored.
+
+    Returns:
+        int: The number of rows inserted.
+    """
+    dialect = db.bind.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        statement = (
+            dialect_insert(InputText).values(rows)
+            .on_conflict_do_nothing(index_elements=["owner_id", "content_hash"])
+            .returning(InputText.id)
+        )
+        return len((await db.execute(statement)).all())
+
+    # Without ON CONFLICT support, filter out the stored hashes first
+    existing = set(await db.scalars(
+        select(InputText.content_hash)
+        .where(InputText.owner_id == rows[0]["owner_id"], InputText.content_hash.in_([row["content_hash"] for row in rows]))
+    ))
+    rows = [row for row in rows if row["content_hash"] not in existing]
+    if rows:
+        await db.execute(insert(InputText).values(rows))
+    return len(rows)
+
+
+class TextInput(BaseModel):
+    text: str
+
+class BulkTextInput(BaseModel):
+    texts: list[str]
+
+@router.post("/submit")
+async def submit_text(data: TextInput, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    # Requires login for now
+    content_hash = roster_hash(data.text)
+    stored = select(InputText.id).where(InputText.owner_id == current_user.id, InputText.content_hash == content_hash)
+    existing_id = await db.scalar(stored)
+    if existing_id is not None:
+        return {"message": "Text already stored", "id": existing_id}
+
+    new_entry = InputText(text=data.text, content_hash=content_hash, owner_id=current_user.id)
+    db.add(new_entry)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # An identical submission committed between the check and the insert
+        await db.rollback()
+        existing_id = await db.scalar(stored)
+        if existing_id is None:
+            raise
+        return {"message": "Text already stored", "id": existing_id}
+    await db.refresh(new_entry)
+    return {"message": "Text stored successfully", "id": new_entry.id}
+
+@router.post("/submit/bulk")
+async def submit_texts(data: BulkTextInput, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if len(data.texts) > MAX_BULK_TEXTS:
+        raise HTTPException(status_code=422, detail=f"Bulk submissions are limited to {MAX_BULK_TEXTS} texts")
+
+    # Repeats within the request collapse here, repeats of stored texts in the database
+    rows = {}
+    for text in data.texts:
+        content_hash = roster_hash(text)
+        rows.setdefault(content_hash, {"text": text, "content_hash": content_hash, "owner_id": current_user.id})
+    rows = list(rows.values())
+
+    inserted = 0
+    for start in range(0, len(rows), SUBMIT_BATCH_SIZE):
+        inserted += await _insert_new_texts(db, rows[start:start + SUBMIT_BATCH_SIZE])
+    await db.commit()
+    return {"message": "Texts stored successfully", "submitted": len(data.texts), "inserted": inserted, "duplicates": len(data.texts) - inserted}
+
+@router.get("/me")
+async def get_me(current_user: User = Depends(get_current_user_claims)):
+    return {"id": current_user.id, "username": current_user.username, "avatar_url": current_user.avatar_url}
+
+@router.get("/db_stats")
+def get_db_stats():
+    return pool_stats()
@@ -1,4 +1,5 @@
 import os
+import json
 from jose import jwt
 from dotenv import load_dotenv
 
@@ -10,3 +11,5 @@ ALGORITHM = "HS256"
 def create_jwt(data: dict):
     return jwt.encode(data, SECRET_KEY, algorithm=ALGORITHM)
 
+def server_sent_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -1,17 +1,29 @@
+import asyncio
+import copy
+import hashlib
 import json
+import logging
+import os
+import time
 from typing import Optional
 from langchain_core.prompts import ChatPromptTemplate
-from .llm import get_llm, get_vectorstore
+from .cache import LRUCache
+from .llm import get_llm, get_vectorstore, track_llm_call, LLM_LIMITER, LLM_SINGLE_FLIGHT, RETRIEVAL_SECONDS
+from .metrics import register_cache
+from .roster import normalized_roster_key
 from typing import Optional
 
 from pydantic import BaseModel, Field
 
 import json
 
+import operator
+import threading
 from langchain import hub
 from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import START, StateGraph
-from typing_extensions import List, TypedDict
+from typing_extensions import Annotated, List, TypedDict
 
 # Pydantic
 class WarbandLore(BaseModel):
@@ -32,6 +44,13 @@ class State(TypedDict):
     context: List[Document]
     answer: WarbandLoreOptions
 
+# State for streaming, where each option is generated by its own node
+class StreamState(TypedDict):
+    warband_text: str
+    warband_theme: str
+    context: List[Document]
+    options: Annotated[List[WarbandLore], operator.add]
+
 
 base_instructions = """
 You are a lore creation assistant for the "Trench Crusade" setting. You have access to Trench Crusade lore documents (provided as context) and must produce a JSON output that describes a warband.
@@ -51,40 +70,150 @@ If no theme info is provided, propose 3 distinct thematic variations.
 If theme info is provided, incorporate that theme but still provide 3 stylistically distinct final outputs.
 """
 
+# Retrieved lore chunks go with the instructions, so the options are grounded in the documents
+lore_context = "\nTrench Crusade lore documents:\n{context}"
+
 prompt_template = ChatPromptTemplate([
-    ("system", base_instructions),
+    ("system", base_instructions + lore_context),
     ("human", "Warband theme: {warband_theme} \n Warband text: {warband_text}"),
 ])
 
-def generate_warband_lore(warband_text: str, theme_info: Optional[str] = None) -> dict:
-    structured_model = get_llm().with_structured_output(WarbandLoreOptions, strict=True)
+# Number of lore chunks retrieved as context
+RETRIEVAL_K = 8
+
+# Finished lore keyed on (normalized roster, theme), and retrieved lore keyed on the normalized roster alone
+LORE_CACHE = LRUCache(maxsize=int(os.getenv("LORE_CACHE_SIZE", "512")), ttl=float(os.getenv("LORE_CACHE_TTL", "86400")))
+RETRIEVAL_CACHE = LRUCache(maxsize=int(os.getenv("RETRIEVAL_CACHE_SIZE", "512")), ttl=float(os.getenv("RETRIEVAL_CACHE_TTL", "86400")))
+register_cache("lore", LORE_CACHE)
+register_cache("retrieval", RETRIEVAL_CACHE)
+
+logger = logging.getLogger(__name__)
+
+# Each streamed option is generated separately, so each gets its own angle to keep them distinct
+OPTION_STYLES = [
+    "Make this variation grim and devout in tone.",
+    "Make this variation pragmatic and mercenary in tone.",
+    "Make this variation strange and mysterious in tone.",
+]
+
+option_prompt_template = ChatPromptTemplate([
+    ("system", base_instructions + "\nFor this request produce only ONE of the variations: {option_style}" + lore_context),
+    ("human", "Warband theme: {warband_theme} \n Warband text: {warband_text}"),
+])
+
+
+def theme_instructions(theme_info: Optional[str]) -> str:
     if theme_info:
-        theme_part = f"The theme information provided: {theme_info}\nIncorporate this theme into all 3 variations."
-    else:
-        theme_part = "No specific theme info given. Provide 3 distinct thematic variations that differ significantly in cultural or conceptual flavor."
+        return f"The theme information provided: {theme_info}\nIncorporate this theme into all 3 variations."
+    return "No specific theme info given. Provide 3 distinct thematic variations that differ significantly in cultural or conceptual flavor."
+
+
+def lore_cache_key(warband_text: str, theme_info: Optional[str]) -> tuple:
+    return normalized_roster_key(warband_text), " ".join((theme_info or "").split()).casefold()
+
+
+# Retrieval only looks at the roster, so lore retrieved for a roster is reused across themes
+async def aretrieve(state):
+    key = normalized_roster_key(state["warband_text"])
+    retrieved_docs = RETRIEVAL_CACHE.get(key)
+    if retrieved_docs is None:
+        # The first call loads the index from disk, which mustn't block the event loop
+        vector_store = await asyncio.to_thread(get_vectorstore)
+        start = time.perf_counter()
+        retrieved_docs = await vector_store.asimilarity_search(state["warband_text"], k=RETRIEVAL_K)
+        RETRIEVAL_SECONDS.observe(time.perf_counter() - start, "async")
+        RETRIEVAL_CACHE.set(key, retrieved_docs)
+    return {"context": retrieved_docs}
+
+
+def _messages(state, template=prompt_template, **extra):
+    docs_content = "\n\n".join(doc.page_content for doc in state["context"])
+    return template.invoke({
+        "warband_text": state["warband_text"],
+        "warband_theme": state["warband_theme"],
+        "context": docs_content,
+        **extra
+    })
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_structured_model(schema):
+    # Structured-output models are built once per schema and shared between requests
+    if schema not in _models:
+        with _models_lock:
+            if schema not in _models:
+                _models[schema] = get_llm().with_structured_output(schema, strict=True)
+    return _models[schema]
+
+
+async def ainvoke_structured(schema, messages):
+    """
+    Call the structured model through the shared limiter, joining an identical call if one is in flight.
+    """
+    key = (schema.__name__, hashlib.sha256(messages.to_string().encode("utf-8")).hexdigest())
 
+    async def call():
+        async with LLM_LIMITER.slot():
+            with track_llm_call(schema.__name__):
+                return await get_structured_model(schema).ainvoke(messages)
 
-    vector_store = get_vectorstore()
-    # Define application steps
-    def retrieve(state: State):
-        retrieved_docs = vector_store.similarity_search(state["warband_text"] + " \n\n " + state["warband_theme"], search_kwargs={"k": 8})
-        return {"context": retrieved_docs}
+    return await LLM_SINGLE_FLIGHT.do(key, call)
 
 
-    def generate(state: State):
-        docs_content = "\n\n".join(doc.page_content for doc in state["context"])
-        messages = prompt_template.invoke({"warband_text": state["warband_text"], "warband_theme": state["warband_theme"], "context": docs_content})
-        response = structured_model.invoke(messages)
-        return {"answer": response}
-    # Compile application and test
-    graph_builder = StateGraph(State).add_sequence([retrieve, generate])
+async def agenerate(state):
+    response = await ainvoke_structured(WarbandLoreOptions, _messages(state))
+    return {"answer": response}
+
+
+def _option_node(index: int):
+    async def agenerate_option(state):
+        messages = _messages(state, option_prompt_template, option_style=OPTION_STYLES[index])
+        response = await ainvoke_structured(WarbandLore, messages)
+        return {"options": [response]}
+    return RunnableLambda(agenerate_option, name=f"generate_option_{index}")
+
+
+def build_lore_graph():
+    graph_builder = StateGraph(State).add_sequence([
+        ("retrieve", RunnableLambda(aretrieve)),
+        ("generate", RunnableLambda(agenerate)),
+    ])
+    graph_builder.add_edge(START, "retrieve")
+    return graph_builder.compile()
+
+
+def build_lore_stream_graph():
+    # Retrieval feeds three option nodes that run concurrently and report as each one finishes
+    graph_builder = StateGraph(StreamState)
+    graph_builder.add_node("retrieve", RunnableLambda(aretrieve))
     graph_builder.add_edge(START, "retrieve")
-    graph = graph_builder.compile()
+    for index in range(len(OPTION_STYLES)):
+        graph_builder.add_node(f"generate_option_{index}", _option_node(index))
+        graph_builder.add_edge("retrieve", f"generate_option_{index}")
+    return graph_builder.compile()
 
-    context = {'warband_text': warband_text, 'warband_theme': theme_part}
-    result = graph.invoke(context)
-    response = result.get('answer', "No answer....")
-    print(f"Raw Response: {response}")
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+def get_lore_graphs() -> dict:
+    """
+    Compile the lore graphs once; call at startup to keep compilation off the request path.
+    """
+    if not _graphs:
+        with _graphs_lock:
+            if not _graphs:
+                _graphs["generate"] = build_lore_graph()
+                _graphs["stream"] = build_lore_stream_graph()
+    return _graphs
+
+
+def _format_response(response) -> dict:
+    logger.debug("Raw lore response: %s", response)
 
     # Ensure response is a JSON string
     try:
@@ -108,8 +237,62 @@ def generate_warband_lore(warband_text: str, theme_info: Optional[str] = None) -
             "details": str(e)
         }
 
+
+def _cache_lore(key: tuple, lore: dict) -> dict:
+    # Failed generations aren't cached so the next request retries
+    if "error" not in lore:
+        LORE_CACHE.set(key, copy.deepcopy(lore))
+    return lore
+
+
+def generate_warband_lore(warband_text: str, theme_info: Optional[str] = None, regenerate: bool = False) -> dict:
+    # For scripts outside an event loop; the graph is async-only so every LLM call goes through the limiter
+    return asyncio.run(agenerate_warband_lore(warband_text, theme_info, regenerate))
+
+
+async def agenerate_warband_lore(warband_text: str, theme_info: Optional[str] = None, regenerate: bool = False) -> dict:
+    key = lore_cache_key(warband_text, theme_info)
+    cached = None if regenerate else LORE_CACHE.get(key)
+    if cached is not None:
+        return copy.deepcopy(cached)
+
+    context = {'warband_text': warband_text, 'warband_theme': theme_instructions(theme_info)}
+    graphs = await asyncio.to_thread(get_lore_graphs)
+    result = await graphs["generate"].ainvoke(context)
+    return _cache_lore(key, _format_response(result.get('answer', "No answer....")))
+
+
+async def stream_warband_lore(warband_text: str, theme_info: Optional[str] = None, regenerate: bool = False):
+    """
+    Generate the three lore options concurrently and yield each one as soon as it is ready.
+
+    Cached lore for the same roster and theme is replayed immediately unless `regenerate` is set.
+
+    Yields:
+        dict: {"index": n, "option": {...}} per finished option, in completion order.
+    """
+    key = lore_cache_key(warband_text, theme_info)
+    cached = None if regenerate else LORE_CACHE.get(key)
+    if cached is not None:
+        for index, option in enumerate(copy.deepcopy(cached)["options"]):
+            yield {"index": index, "option": option}
+        return
+
+    options = [None] * len(OPTION_STYLES)
+    context = {'warband_text': warband_text, 'warband_theme': theme_instructions(theme_info), 'options': []}
+    graphs = await asyncio.to_thread(get_lore_graphs)
+    async for update in graphs["stream"].astream(context, stream_mode="updates"):
+        for node, values in update.items():
+            if node.startswith("generate_option_"):
+                for option in values["options"]:
+                    index = int(node.rsplit("_", 1)[1])
+                    options[index] = option.model_dump()
+                    yield {"index": index, "option": options[index]}
+    _cache_lore(key, {"options": options})
+
+
 if __name__ == "__main__":
     response = generate_warband_lore("Black grail knight, corpse guard, puppy of the night")
     print(f"True response: {type(response)}, {list(response.keys())}, \n {response}")
     import pdb;
-    pdb.set_trace()
\ No newline at end of file
+    pdb.set_trace()
@@ -79,18 +79,13 @@ function App() {
 
   async function computeAll() {
     try {
-      // Compute success distribution first
-      const sdResp = await axios.post(`${API_BASE}/compute_success_distribution`, params)
-      setSuccessDistribution(sdResp.data.success_distribution)
-
-      // Once we have success distribution, compute injury outcome
-      const hit_distribution = sdResp.data.success_distribution
-      const ioReq = {
-        hit_distribution,
+      // Compute success distribution and injury outcome in one request
+      const attackResp = await axios.post(`${API_BASE}/compute_attack`, {
+        hit_params: params,
         injury_params: injuryParams
-      }
-      const ioResp = await axios.post(`${API_BASE}/compute_injury_outcome`, ioReq)
-      setInjuryOutcome(ioResp.data)
+      })
+      setSuccessDistribution(attackResp.data.success_distribution)
+      setInjuryOutcome(attackResp.data)
     } catch (e) {
       console.error(e)
     }